@@ -0,0 +1,440 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+
+import cv2
+import numpy as np
+
+AI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SKIN_DIR = os.path.join(AI_DIR, 'skin_disease')
+LICENSE_DIR = os.path.join(AI_DIR, 'license-verifier')
+
+SYNTHETIC_CLASSES = ['cat_dermatitis', 'cat_ringworm', 'dog_dermatitis', 'dog_ringworm', 'dog_scabies']
+KEYWORD_LINES = ['State of Palestine', 'Ministry of Agriculture', 'Veterinary Practice License']
+
+# Metrics whose name ends in one of these get worse when they go up;
+# throughput metrics get worse when they go down.
+LOWER_IS_BETTER = ('_ms', '_mb')
+HIGHER_IS_BETTER = ('_per_sec',)
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        'count': int(samples.size),
+        'mean_ms': round(float(samples.mean()), 3),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p90_ms': round(float(np.percentile(samples, 90)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3)
+    }
+
+
+def time_stage(func, inputs, repeat=1):
+    """Per-call latencies (ms) of func over inputs, after one untimed warm-up call"""
+    func(inputs[0])
+    latencies = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            func(item)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return percentiles(latencies)
+
+
+def concurrency_sweep(make_request, payloads, levels, requests_per_level):
+    """Throughput and latency of make_request with N concurrent callers"""
+    results = {}
+    for level in levels:
+        latencies = []
+        lock = threading.Lock()
+
+        def one(i):
+            start = time.perf_counter()
+            make_request(payloads[i % len(payloads)])
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+
+        total = max(requests_per_level, level)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            list(pool.map(one, range(total)))
+        wall = time.perf_counter() - start
+        results[f'c{level}'] = dict(percentiles(latencies), throughput_per_sec=round(total / wall, 3))
+    return results
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process, or None where it isn't available (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def synthetic_photos(count, seed=0):
+    """Smooth random colour fields at typical phone-upload sizes, JPEG encoded"""
+    rng = np.random.RandomState(seed)
+    photos = []
+    for _ in range(count):
+        small = rng.randint(0, 256, (12, 16, 3), dtype=np.uint8)
+        image = cv2.resize(small, (1600, 1200), interpolation=cv2.INTER_CUBIC)
+        noise = rng.randint(-12, 12, image.shape)
+        image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        photos.append(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+    return photos
+
+
+def synthetic_stamp(size=300):
+    """Asymmetric round stamp, so template matching has a single clear peak"""
+    stamp = np.full((size, size, 3), 255, dtype=np.uint8)
+    center = (size // 2, size // 2)
+    cv2.circle(stamp, center, size // 2 - 6, (140, 40, 30), 6)
+    cv2.circle(stamp, center, size // 2 - 30, (140, 40, 30), 3)
+    cv2.putText(stamp, 'MoA', (size // 4, size // 2 + 15), cv2.FONT_HERSHEY_DUPLEX, 2.0, (140, 40, 30), 4)
+    cv2.line(stamp, (size // 4, size - 90), (size - 80, size - 70), (140, 40, 30), 4)
+    return stamp
+
+
+def synthetic_seal(size=300):
+    """A different round seal, for documents that must not match the reference stamp"""
+    seal = np.full((size, size, 3), 255, dtype=np.uint8)
+    center = (size // 2, size // 2)
+    cv2.circle(seal, center, size // 2 - 8, (30, 40, 150), 5)
+    cv2.circle(seal, center, size // 2 - 40, (30, 40, 150), 2)
+    cv2.putText(seal, 'CITY', (size // 5, size // 2 + 12), cv2.FONT_HERSHEY_COMPLEX, 1.6, (30, 40, 150), 3)
+    cv2.rectangle(seal, (size // 3, size // 5), (2 * size // 3, size // 3), (30, 40, 150), 3)
+    return seal
+
+
+def synthetic_documents(count, stamp, seed=0):
+    """License-like pages: printed keyword lines, filler text and ``stamp`` (none if None)"""
+    rng = np.random.RandomState(seed)
+    documents = []
+    for i in range(count):
+        page = np.full((2339, 1654, 3), 250, dtype=np.uint8)
+        y = 200
+        for line in KEYWORD_LINES:
+            cv2.putText(page, line, (150, y), cv2.FONT_HERSHEY_SIMPLEX, 2.2, (20, 20, 20), 4)
+            y += 140
+        for _ in range(12):
+            words = ' '.join(''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz'), rng.randint(3, 9)))
+                             for _ in range(6))
+            cv2.putText(page, words, (150, y), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (40, 40, 40), 2)
+            y += 90
+        if stamp is None:
+            documents.append(cv2.imencode('.jpg', page, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes())
+            continue
+        side = int(page.shape[1] * rng.uniform(0.15, 0.3))
+        resized = cv2.resize(stamp, (side, side), interpolation=cv2.INTER_AREA)
+        x0, y0 = page.shape[1] - side - 150, page.shape[0] - side - 200 - 20 * (i % 5)
+        page[y0:y0 + side, x0:x0 + side] = np.minimum(page[y0:y0 + side, x0:x0 + side], resized)
+        documents.append(cv2.imencode('.jpg', page, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes())
+    return documents
+
+
+def write_synthetic_checkpoint(path):
+    """Randomly initialised ResNet-50 in the best_model.pth layout"""
+    import torch
+    from torchvision import models
+
+    model = models.resnet50(weights=None)
+    model.fc = torch.nn.Linear(model.fc.in_features, len(SYNTHETIC_CLASSES))
+    torch.save({'model_state_dict': model.state_dict(), 'class_names': SYNTHETIC_CLASSES}, path)
+
+
+def bench_skin(config):
+    sys.path.insert(0, SKIN_DIR)
+    workdir = tempfile.mkdtemp(prefix='skin_bench_')
+    try:
+        model_path = config['model'] or os.path.join(workdir, 'best_model.pth')
+        if not config['model']:
+            write_synthetic_checkpoint(model_path)
+        # Caching would turn repeated payloads into lookups and hide the model cost
+        os.environ['MODEL_PATH'] = model_path
+        os.environ['PREDICTION_CACHE_SIZE'] = '0'
+        # Admission control would turn the higher concurrency levels into 429s
+        os.environ['MAX_PENDING_REQUESTS'] = str(max(config['concurrency']))
+
+        import torch
+        import app as skin_app
+
+        torch.set_num_threads(config['threads'] or torch.get_num_threads())
+        classifier = skin_app.classifier
+        photos = synthetic_photos(config['images'], seed=config['seed'])
+        species = sorted(classifier.species_ids)[0]
+
+        decoded = [classifier.load_image(p) for p in photos]
+        tensors = [classifier.transform(img) for img in decoded]
+        stages = {
+            'decode': time_stage(classifier.load_image, photos),
+            'transform': time_stage(classifier.transform, decoded),
+            'forward_batch1': time_stage(lambda t: classifier.predict_tensors([t], [species]), tensors),
+            'predict_end_to_end': time_stage(lambda p: classifier.predict(p, species), photos)
+        }
+
+        batch_throughput = {}
+        for size in config['batch_sizes']:
+            batch = (tensors * size)[:size]
+            result = time_stage(lambda b: classifier.predict_tensors(b, [species] * len(b)), [batch],
+                                repeat=max(1, config['images'] // size))
+            result['images_per_sec'] = round(size * 1000 / result['mean_ms'], 3)
+            batch_throughput[f'b{size}'] = result
+
+        client_local = threading.local()
+
+        def post(payload):
+            if not hasattr(client_local, 'client'):
+                client_local.client = skin_app.app.test_client()
+            response = client_local.client.post('/predict', data={
+                'image': (io.BytesIO(payload), 'bench.jpg'),
+                'species': species
+            }, content_type='multipart/form-data')
+            if response.status_code != 200:
+                raise RuntimeError(f"/predict returned {response.status_code}: {response.get_data(as_text=True)}")
+
+        post(photos[0])
+        endpoint = concurrency_sweep(post, photos, config['concurrency'], config['requests'])
+
+        return {
+            'model': 'synthetic' if not config['model'] else config['model'],
+            'backend': classifier.backend,
+            'stages': stages,
+            'batch_throughput': batch_throughput,
+            'endpoint': endpoint,
+            'peak_rss_mb': peak_rss_mb()
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_license(config):
+    sys.path.insert(0, LICENSE_DIR)
+    os.environ['VERIFY_CACHE_SIZE'] = '0'
+    os.environ['MAX_PENDING_REQUESTS'] = str(max(config['concurrency']))
+    import pytesseract
+    import license_verifier as lv
+
+    lv.logger.setLevel('WARNING')
+    # The module points at a developer's Windows install; use PATH instead
+    pytesseract.pytesseract.tesseract_cmd = config['tesseract_cmd']
+    try:
+        pytesseract.get_tesseract_version()
+        ocr_available = True
+    except Exception:
+        ocr_available = False
+        print("tesseract not found; OCR stages are skipped")
+
+    stamp = synthetic_stamp()
+    lv.reference_image = stamp
+    lv.stamp_templates = lv.build_stamp_templates(stamp)
+    documents = synthetic_documents(config['documents'], stamp, seed=config['seed'])
+    images = [lv.decode_bgr(d, lv.DECODE_MIN_DIM) for d in documents]
+    # Same pages without the stamp, or with another office's seal, calibrate STAMP_MATCH_THRESHOLD
+    unstamped = [lv.decode_bgr(d, lv.DECODE_MIN_DIM)
+                 for d in synthetic_documents(config['documents'], None, seed=config['seed'] + 1)]
+    other_seal = [lv.decode_bgr(d, lv.DECODE_MIN_DIM)
+                  for d in synthetic_documents(config['documents'], synthetic_seal(), seed=config['seed'] + 2)]
+
+    stages = {
+        'decode': time_stage(lambda d: lv.decode_bgr(d, lv.DECODE_MIN_DIM), documents),
+        'is_stamp_present': time_stage(lv.is_stamp_present, images),
+        'prepare_for_ocr': time_stage(lv.prepare_for_ocr, images)
+    }
+    if ocr_available:
+        stages['contains_required_keywords'] = time_stage(lv.contains_required_keywords, images)
+
+    result = {
+        'ocr_backend': lv.ocr_engine.backend if ocr_available else None,
+        'stamp_detected_rate': round(float(np.mean([lv.is_stamp_present(img) is True for img in images])), 3),
+        'stamp_false_positive_rate': round(float(np.mean([lv.is_stamp_present(img) is True for img in unstamped])), 3),
+        'other_seal_false_positive_rate': round(float(np.mean([lv.is_stamp_present(img) is True for img in other_seal])), 3),
+        'stamp_scores': {
+            'threshold': lv.STAMP_MATCH_THRESHOLD,
+            'stamped_min': round(min(lv.match_stamp(img)[0] for img in images), 3),
+            'unstamped_max': round(max(lv.match_stamp(img)[0] for img in unstamped), 3),
+            'other_seal_max': round(max(lv.match_stamp(img)[0] for img in other_seal), 3)
+        },
+        'stages': stages
+    }
+
+    if ocr_available:
+        client_local = threading.local()
+
+        def post(payload):
+            if not hasattr(client_local, 'client'):
+                client_local.client = lv.app.test_client()
+            response = client_local.client.post('/verify-license', data={
+                'licenseImage': (io.BytesIO(payload), 'license.jpg')
+            }, content_type='multipart/form-data')
+            if response.status_code != 200:
+                raise RuntimeError(f"/verify-license returned {response.status_code}")
+
+        post(documents[0])
+        result['endpoint'] = concurrency_sweep(post, documents, config['concurrency'], config['requests'])
+
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+SUITES = {'skin': bench_skin, 'license': bench_license}
+
+
+def _run_suite(name, config, queue):
+    try:
+        queue.put(SUITES[name](config))
+    except Exception as e:
+        queue.put({'error': str(e)})
+
+
+def run_isolated(name, config, timeout=None):
+    """Run one suite in a fresh process so its peak RSS is its own.
+
+    A child that dies without reporting (crash, OOM kill) or runs past
+    ``timeout`` seconds is recorded as an error instead of blocking the run.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_suite, args=(name, config, results))
+    process.start()
+    deadline = time.monotonic() + timeout if timeout else None
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=5)
+        except Empty:
+            if not process.is_alive():
+                # The result may still be in flight if the child exited just now
+                try:
+                    result = results.get(timeout=1)
+                except Empty:
+                    result = {'error': f"suite process exited with code {process.exitcode} without a result"}
+            elif deadline is not None and time.monotonic() > deadline:
+                process.terminate()
+                result = {'error': f"suite did not finish within {timeout}s"}
+    process.join()
+    return result
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(results, baseline, tolerance):
+    """List of (metric, baseline, current, change) that got worse by more than tolerance"""
+    current = flatten(results['suites'])
+    reference = flatten(baseline['suites'])
+    regressions = []
+    for metric, old in reference.items():
+        new = current.get(metric)
+        if new is None or not old:
+            continue
+        change = (new - old) / old
+        if metric.endswith(LOWER_IS_BETTER) and change > tolerance:
+            regressions.append((metric, old, new, change))
+        elif metric.endswith(HIGHER_IS_BETTER) and change < -tolerance:
+            regressions.append((metric, old, new, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline latency/throughput benchmarks for the AI services')
+    parser.add_argument('--suites', nargs='+', default=list(SUITES), choices=list(SUITES))
+    parser.add_argument('--model', default=None,
+                        help='Skin model artifact (default: a randomly initialised ResNet-50)')
+    parser.add_argument('--images', type=int, default=32, help='Synthetic photos for the skin suite')
+    parser.add_argument('--documents', type=int, default=8, help='Synthetic documents for the license suite')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--requests', type=int, default=32, help='Requests per concurrency level')
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    parser.add_argument('--tesseract-cmd', default='tesseract')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default=None, help='Compare against this earlier results file')
+    parser.add_argument('--suite-timeout', type=float, default=3600,
+                        help='Seconds before a suite that has not finished counts as failed (0: no limit)')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed relative slowdown before a metric counts as a regression')
+    args = parser.parse_args()
+
+    config = {
+        'model': os.path.abspath(args.model) if args.model else None,
+        'images': args.images,
+        'documents': args.documents,
+        'batch_sizes': args.batch_sizes,
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'threads': args.threads,
+        'tesseract_cmd': args.tesseract_cmd,
+        'seed': args.seed
+    }
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'config': config,
+        'suites': {}
+    }
+
+    failed = False
+    for name in args.suites:
+        print(f"Running {name} benchmarks...")
+        results['suites'][name] = run_isolated(name, config, args.suite_timeout)
+        if 'error' in results['suites'][name]:
+            print(f"{name} failed: {results['suites'][name]['error']}")
+            failed = True
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    for name, suite in results['suites'].items():
+        for stage, summary in suite.get('stages', {}).items():
+            print(f"{name:<8} {stage:<28} p50 {summary['p50_ms']:9.1f} ms  p99 {summary['p99_ms']:9.1f} ms")
+        for level, summary in suite.get('endpoint', {}).items():
+            print(f"{name:<8} endpoint {level:<19} {summary['throughput_per_sec']:9.2f} req/s  "
+                  f"p99 {summary['p99_ms']:9.1f} ms")
+        if 'stamp_scores' in suite:
+            scores = suite['stamp_scores']
+            print(f"{name:<8} stamp score min {scores['stamped_min']:.3f} with stamp, "
+                  f"max {scores['unstamped_max']:.3f} without, max {scores['other_seal_max']:.3f} "
+                  f"with another seal (threshold {scores['threshold']})")
+        if suite.get('peak_rss_mb') is not None:
+            print(f"{name:<8} peak RSS {suite['peak_rss_mb']:.0f} MB")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for metric, old, new, change in regressions:
+            print(f"REGRESSION {metric}: {old} -> {new} ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
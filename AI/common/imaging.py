@@ -0,0 +1,109 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Only the OpenCV path (decode_bgr) needs cv2; the skin service doesn't ship it
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+EXIF_ORIENTATION = 0x0112
+
+
+def load_pil(source, min_size=None):
+    """Decode a path, bytes or file-like object to an upright RGB PIL image.
+
+    With ``min_size`` set, JPEGs are decoded at the smallest DCT scale that
+    keeps both sides at least ``min_size`` pixels, which for a 12 MP photo
+    and a 256 px model input is an eighth of the pixels and memory.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        if min_size is not None:
+            img.draft('RGB', (min_size, min_size))
+        # Phones store portrait photos sideways plus an orientation tag
+        return ImageOps.exif_transpose(img).convert('RGB')
+
+
+def _header(data):
+    """(format, width, height, EXIF orientation) without decoding any pixels"""
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            return img.format, img.width, img.height, img.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        return None, None, None, 1
+
+
+def _apply_orientation(image, orientation):
+    if orientation in (2, 4, 5, 7):
+        image = cv2.flip(image, 1)
+    if orientation in (3, 4):
+        image = cv2.rotate(image, cv2.ROTATE_180)
+    elif orientation in (6, 7):
+        image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    elif orientation in (5, 8):
+        image = cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def check_orientations():
+    """Compare _apply_orientation with ImageOps.exif_transpose for all 8 EXIF orientations"""
+    rgb = np.arange(3 * 4 * 3, dtype=np.uint8).reshape(3, 4, 3)
+    mismatches = []
+    for orientation in range(1, 9):
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = orientation
+        img = Image.fromarray(rgb)
+        img.info['exif'] = exif.tobytes()
+        expected = np.asarray(ImageOps.exif_transpose(img))
+        actual = _apply_orientation(rgb[:, :, ::-1], orientation)[:, :, ::-1]
+        if expected.shape != actual.shape or not np.array_equal(expected, actual):
+            mismatches.append(orientation)
+    return mismatches
+
+
+def reduction_factor(width, height, min_long_side):
+    """Largest of 1, 2, 4, 8 that keeps the long side at least ``min_long_side``"""
+    long_side = max(width, height)
+    factor = 1
+    for candidate in (2, 4, 8):
+        if long_side // candidate >= min_long_side:
+            factor = candidate
+    return factor
+
+
+def decode_bgr(data, min_long_side=None):
+    """Decode upload bytes to an upright BGR array for OpenCV.
+
+    JPEGs are decoded at a reduced scale when the long side still comes out
+    at least ``min_long_side`` pixels. Returns None if the data can't be decoded.
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    image_format, width, height, orientation = _header(data)
+
+    factor = 1
+    if min_long_side is not None and image_format == 'JPEG':
+        factor = reduction_factor(width, height, min_long_side)
+
+    # Orientation is applied here so it is the same whatever OpenCV version
+    # or reduced-decode flag is in use
+    flags = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8
+    }[factor]
+    image = cv2.imdecode(buffer, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        return None
+    return _apply_orientation(image, orientation)
+
+
+if __name__ == '__main__':
+    mismatches = check_orientations()
+    if mismatches:
+        raise SystemExit(f"Orientations differing from PIL: {mismatches}")
+    print("All 8 EXIF orientations match ImageOps.exif_transpose")
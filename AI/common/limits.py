@@ -0,0 +1,100 @@
+import io
+import threading
+from functools import wraps
+
+from flask import jsonify
+from PIL import Image
+
+
+class UploadRejected(Exception):
+    """An upload broke a size or dimension limit; ``status`` is the HTTP code to return"""
+
+    def __init__(self, message, status=413):
+        super().__init__(message)
+        self.status = status
+
+
+class AdmissionGate:
+    """Caps how many requests may be working or queued at once.
+
+    Admission never blocks: once ``max_pending`` requests are inside, new
+    ones are turned away immediately so the caller can answer 429 instead
+    of letting work pile up until every request times out.
+    """
+
+    def __init__(self, max_pending):
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+        self.max_pending = max_pending
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+
+    def try_acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.pending += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {'pending': self.pending, 'max_pending': self.max_pending, 'rejected': self.rejected}
+
+
+def admit(gate, retry_after=1, body=None):
+    """Decorate a Flask view so it answers 429 with Retry-After when ``gate`` is full.
+
+    The check runs before the request body is parsed, so a rejected upload
+    costs next to nothing.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not gate.try_acquire():
+                payload = dict(body) if body is not None else {'error': 'Server busy, retry later'}
+                return jsonify(payload), 429, {'Retry-After': str(retry_after)}
+            try:
+                return view(*args, **kwargs)
+            finally:
+                gate.release()
+        return wrapper
+    return decorator
+
+
+def read_upload(file, max_bytes, chunk_size=64 * 1024):
+    """Read an uploaded file in chunks, stopping as soon as it exceeds ``max_bytes``"""
+    buffer = io.BytesIO()
+    while True:
+        chunk = file.stream.read(chunk_size)
+        if not chunk:
+            return buffer.getvalue()
+        if buffer.tell() + len(chunk) > max_bytes:
+            raise UploadRejected(f"Upload exceeds {max_bytes // (1024 * 1024)} MB limit")
+        buffer.write(chunk)
+
+
+def check_dimensions(data, max_pixels):
+    """Reject images whose header declares more than ``max_pixels`` pixels.
+
+    Only the header is parsed, so an oversized or decompression-bomb image
+    is refused before any memory is spent decoding it.
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(str(e))
+    except Exception:
+        raise UploadRejected("Invalid image file", status=400)
+    if width * height > max_pixels:
+        raise UploadRejected(f"Image is {width}x{height}; the limit is {max_pixels} pixels")
+    return width, height
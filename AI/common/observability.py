@@ -0,0 +1,127 @@
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+logger = logging.getLogger(__name__)
+
+# 5 ms to 30 s, wide enough for both a cache hit and a cold OCR pass
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def multiprocess_enabled():
+    # Set by gunicorn.conf.py so every worker writes to a shared directory
+    return bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+
+def mark_process_dead(pid):
+    """Drop a stopped gunicorn worker's live gauges from the shared metrics"""
+    if multiprocess_enabled():
+        multiprocess.mark_process_dead(pid)
+
+
+def metrics_payload():
+    """Prometheus text for this process, or summed over all workers in multiprocess mode"""
+    if multiprocess_enabled():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+class RequestProfiler:
+    """Profiles a random sample of requests with cProfile.
+
+    ``sample_rate`` is the fraction of requests to profile (0 disables it).
+    Only one request per process is profiled at a time, because the
+    interpreter supports a single active profiler. Each profile is written
+    to ``output_dir`` as a ``.prof`` file for ``snakeviz`` or ``pstats``.
+
+    cProfile only sees the thread that enabled it, i.e. the request thread.
+    Work handed to other threads (the skin service's batch scheduler, which
+    runs the model forward, or the license verifier's stamp and OCR
+    executor) shows up only as the time the request spent waiting on it;
+    the per-stage histograms on /metrics cover those threads.
+    """
+
+    def __init__(self, sample_rate=0.0, output_dir='profiles'):
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except Exception:
+            self._lock.release()
+            return None
+        return profiler
+
+    def stop(self, profiler, name):
+        try:
+            profiler.disable()
+            os.makedirs(self.output_dir, exist_ok=True)
+            label = name.strip('/').replace('/', '_') or 'root'
+            path = os.path.join(self.output_dir, f'{label}_{os.getpid()}_{time.time_ns()}.prof')
+            profiler.dump_stats(path)
+            logger.info(f"Request profile written to {path}")
+        finally:
+            self._lock.release()
+
+
+def instrument(app, namespace):
+    """Count and time every request of a Flask app and serve them on /metrics.
+
+    Stage-level metrics are defined by each service; this covers what all
+    endpoints share: request counts by status, errors and total latency.
+    """
+    requests_total = Counter(f'{namespace}_requests_total', 'HTTP requests handled', ['endpoint', 'status'])
+    errors_total = Counter(f'{namespace}_errors_total', 'HTTP requests that failed', ['endpoint', 'kind'])
+    request_seconds = Histogram(f'{namespace}_request_seconds', 'End-to-end request latency',
+                                ['endpoint'], buckets=LATENCY_BUCKETS)
+    profiler = RequestProfiler(
+        sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+        output_dir=os.environ.get('PROFILE_DIR', 'profiles')
+    )
+
+    def endpoint_name():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    @app.before_request
+    def start_request():
+        g.request_start = time.perf_counter()
+        g.request_profiler = profiler.start() if request.path != '/metrics' else None
+
+    @app.after_request
+    def record_request(response):
+        endpoint = endpoint_name()
+        if endpoint != '/metrics':
+            requests_total.labels(endpoint, str(response.status_code)).inc()
+            request_seconds.labels(endpoint).observe(time.perf_counter() - g.request_start)
+            if response.status_code >= 400:
+                errors_total.labels(endpoint, 'client' if response.status_code < 500 else 'server').inc()
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        # Runs even when the view raised, so the profiler lock is always released
+        active = g.pop('request_profiler', None)
+        if active is not None:
+            profiler.stop(active, endpoint_name())
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(metrics_payload(), mimetype=CONTENT_TYPE_LATEST)
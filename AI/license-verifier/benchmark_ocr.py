@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+import pytesseract
+
+import license_verifier as lv
+
+
+def full_page_baseline(image):
+    """The original path: full-colour, full-resolution image through a tesseract subprocess"""
+    text = pytesseract.image_to_string(image, config=r'--oem 3 --psm 6')
+    return lv._find_keyword(text) is not None
+
+
+def load_images(directory):
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if lv.allowed_file(name):
+            image = cv2.imread(os.path.join(directory, name))
+            if image is not None:
+                images.append((name, image))
+    return images
+
+
+def run(method, images):
+    latencies, detected = [], []
+    for _, image in images:
+        start = time.perf_counter()
+        detected.append(bool(method(image)))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, detected
+
+
+def summarize(latencies, detected, positive):
+    hits = sum(detected)
+    return {
+        'images': len(detected),
+        'mean_ms': float(np.mean(latencies)) if latencies else 0.0,
+        'p50_ms': float(np.percentile(latencies, 50)) if latencies else 0.0,
+        'p95_ms': float(np.percentile(latencies, 95)) if latencies else 0.0,
+        # Recall on licenses, false-positive rate on non-licenses
+        ('recall' if positive else 'false_positive_rate'): hits / len(detected) if detected else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare full-page and region-of-interest keyword OCR')
+    parser.add_argument('licenses', help='Directory of sample license photos (all expected to match)')
+    parser.add_argument('--negatives', help='Optional directory of documents that must not match')
+    parser.add_argument('--output', default='ocr_benchmark.json')
+    args = parser.parse_args()
+
+    methods = {'full_page': full_page_baseline, 'roi': lv.contains_required_keywords}
+    report = {}
+    for label, directory, positive in [('licenses', args.licenses, True), ('negatives', args.negatives, False)]:
+        if not directory:
+            continue
+        images = load_images(directory)
+        print(f"{label}: {len(images)} images from {directory}")
+        for name, method in methods.items():
+            latencies, detected = run(method, images)
+            report.setdefault(name, {})[label] = summarize(latencies, detected, positive)
+            missed = [n for (n, _), d in zip(images, detected) if d != positive]
+            if missed:
+                report[name][label]['mismatched'] = missed
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for name, results in report.items():
+        for label, summary in results.items():
+            quality = summary.get('recall', summary.get('false_positive_rate'))
+            print(f"{name:<10} {label:<10} mean {summary['mean_ms']:8.1f} ms  "
+                  f"p95 {summary['p95_ms']:8.1f} ms  {'recall' if 'recall' in summary else 'fpr'} {quality:.2f}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Production serving for the license verifier:
+#
+#     gunicorn -c gunicorn.conf.py license_verifier:app
+#
+# The reference stamp is loaded once in the master and shared copy-on-write
+# with the forked workers. Each worker caps OpenCV's thread pool and runs a
+# warm-up verification before it starts accepting requests.
+import gc
+import glob
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('BIND', '0.0.0.0:' + os.environ.get('PYTHON_PORT', '5001'))
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('WORKER_THREADS', 4))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 60))
+preload_app = True
+
+# Split the cores between workers so they don't oversubscribe the CPU
+cv_threads = int(os.environ.get('CV_THREADS', max(1, multiprocessing.cpu_count() // workers)))
+
+# Tesseract uses OpenMP internally; keep each OCR call to its share of cores
+os.environ.setdefault('OMP_THREAD_LIMIT', str(cv_threads))
+
+# Per-worker metric files that /metrics sums over; cleared on startup so a
+# restart doesn't count the previous run twice
+metrics_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'license_verifier_metrics')
+)
+os.makedirs(metrics_dir, exist_ok=True)
+for stale in glob.glob(os.path.join(metrics_dir, '*.db')):
+    os.remove(stale)
+
+
+def when_ready(server):
+    # Keep the GC from touching (and copying) pages shared with the workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import cv2
+    import license_verifier
+
+    cv2.setNumThreads(cv_threads)
+    license_verifier.warm_up()
+    server.log.info(f"Worker {worker.pid} warmed up with {cv_threads} OpenCV threads")
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,13 +1,35 @@
 import cv2
 import numpy as np
 from flask import Flask, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
 import pytesseract
 import logging
 import os
-import traceback
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+# Code shared with the skin disease service lives in AI/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import metrics
+from imaging import decode_bgr
+from limits import AdmissionGate, UploadRejected, admit, check_dimensions, read_upload
+from ocr_pool import TesseractPool
+from verification_cache import VerificationCache, perceptual_hash
 pytesseract.pytesseract.tesseract_cmd = r'C:\Users\ASUS\Downloads\tesseract-ocr-w64-setup-5.5.0.20241111 (1).exe'
+# Upload limits, enforced while the body is read and before any pixel is decoded
+MAX_UPLOAD_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', 15)) * 1024 * 1024)
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 50_000_000))
+# Verifications allowed in flight per worker; keep it below gunicorn's
+# WORKER_THREADS so /health and /metrics always get a thread
+MAX_PENDING_REQUESTS = int(os.environ.get('MAX_PENDING_REQUESTS', 3))
+RETRY_AFTER_SECONDS = int(os.environ.get('RETRY_AFTER_SECONDS', 2))
+
 # Initialize Flask app
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+# Request counts/latency on /metrics; PROFILE_SAMPLE_RATE turns on cProfile sampling
+metrics.instrument(app, 'license')
 
 # Set logging
 logging.basicConfig(level=logging.INFO)
@@ -26,29 +48,155 @@ reference_image = cv2.imread(REFERENCE_IMAGE_PATH)
 if reference_image is None:
     logger.error("Reference stamp image not found or failed to load!")
 
+# Stamp matching config. Documents are normalized so their long side is
+# MATCH_MAX_DIM pixels; stamp sizes are then expressed as a fraction of that
+# long side, which makes matching cost independent of upload resolution.
+MATCH_MAX_DIM = int(os.environ.get('STAMP_MATCH_MAX_DIM', 1000))
+COARSE_FACTOR = float(os.environ.get('STAMP_COARSE_FACTOR', 0.5))
+STAMP_SCALES = [float(s) for s in os.environ.get('STAMP_SCALES', '0.1,0.12,0.14,0.16,0.18,0.21,0.24,0.27,0.31,0.35').split(',')]
+# Edge-map scores of pages without a stamp reach about 0.22 and pages with
+# one score 0.36 or more (run_benchmarks.py --suites license reports both).
+# Another round seal can score as high as the real stamp, so this threshold
+# only separates stamped from unstamped pages; the keyword OCR does the rest.
+STAMP_MATCH_THRESHOLD = float(os.environ.get('STAMP_MATCH_THRESHOLD', 0.3))
+# A refined score above this ends the search without trying other scales
+STAMP_CONFIDENT_SCORE = float(os.environ.get('STAMP_CONFIDENT_SCORE', 0.35))
+# Number of best coarse candidates that get refined at full working resolution
+STAMP_REFINE_CANDIDATES = int(os.environ.get('STAMP_REFINE_CANDIDATES', 3))
+
+def _edges(gray):
+    # Thickened edges tolerate the small size/offset error between pyramid levels
+    return cv2.dilate(cv2.Canny(gray, 50, 200), np.ones((3, 3), np.uint8))
+
+def build_stamp_templates(reference):
+    """Precompute reference stamp edge maps for every scale at both pyramid levels"""
+    gray_stamp = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY)
+    templates = []
+    for scale in STAMP_SCALES:
+        width = scale * MATCH_MAX_DIM
+        factor = width / gray_stamp.shape[1]
+        fine = cv2.resize(gray_stamp, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+        coarse = cv2.resize(fine, None, fx=COARSE_FACTOR, fy=COARSE_FACTOR, interpolation=cv2.INTER_AREA)
+        templates.append({'scale': scale, 'fine': _edges(fine), 'coarse': _edges(coarse)})
+    return templates
+
+stamp_templates = build_stamp_templates(reference_image) if reference_image is not None else []
+
+# Stamp detection and OCR run side by side on this pool. Threads are only
+# started on first use, so the pool is safe to create before gunicorn forks.
+verify_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('VERIFY_WORKERS', 4)),
+    thread_name_prefix='verify'
+)
+
+REQUIRED_KEYWORDS = ["Ministry of Agriculture", "State of Palestine"]
+
+# Retries with the same photo reuse the earlier verdict. A VERIFY_CACHE_MAX_DISTANCE
+# above 0 also lets near-identical photos reuse a rejection, never an approval.
+verification_cache = VerificationCache(
+    max_entries=int(os.environ.get('VERIFY_CACHE_SIZE', 2048)),
+    max_distance=int(os.environ.get('VERIFY_CACHE_MAX_DISTANCE', 0)),
+    ttl=float(os.environ.get('VERIFY_CACHE_TTL', 24 * 3600))
+)
+
+# OCR preprocessing config. Pages are resized so their long side matches
+# OCR_TARGET_DPI on a page OCR_PAGE_INCHES long (A4 by default), which keeps
+# body text at a size Tesseract reads well without paying for extra pixels.
+OCR_TARGET_DPI = int(os.environ.get('OCR_TARGET_DPI', 200))
+OCR_PAGE_INCHES = float(os.environ.get('OCR_PAGE_INCHES', 11.69))
+OCR_MAX_REGIONS = int(os.environ.get('OCR_MAX_REGIONS', 4))
+# OCR the whole page when no text region is found at all
+OCR_FULL_PAGE_FALLBACK = os.environ.get('OCR_FULL_PAGE_FALLBACK', 'true').lower() == 'true'
+
+# Uploads are decoded at 1/2, 1/4 or 1/8 scale when the long side stays at
+# least this big: enough for OCR at the target DPI and for stamp matching
+DECODE_MIN_DIM = max(MATCH_MAX_DIM, int(OCR_TARGET_DPI * OCR_PAGE_INCHES))
+
+# Overflow beyond this is answered with 429 instead of queueing behind the executor
+admission_gate = AdmissionGate(MAX_PENDING_REQUESTS)
+
+# Long-lived Tesseract engines; size bounds how many OCR calls run at once
+ocr_engine = TesseractPool(size=int(os.environ.get('OCR_POOL_SIZE', 2)), lang='eng', psm=6, oem=3,
+                           dpi=OCR_TARGET_DPI)
+
+# Set once this process has run a warm-up verification; reported by /health
+warmed_up = False
+
+def warm_up():
+    """Exercise the stamp matcher and OCR once so the first request is not slower"""
+    global warmed_up
+    blank = np.full((400, 600, 3), 255, dtype=np.uint8)
+    ocr_engine.warm_up()
+    is_stamp_present(blank)
+    contains_required_keywords(blank)
+    warmed_up = True
+    logger.info("Warm-up complete.")
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _best_match(edges, template):
+    if edges.shape[0] < template.shape[0] or edges.shape[1] < template.shape[1]:
+        return -1.0, (0, 0)
+    result = cv2.matchTemplate(edges, template, cv2.TM_CCOEFF_NORMED)
+    _, max_val, _, max_loc = cv2.minMaxLoc(result)
+    return max_val, max_loc
+
+def match_stamp(target_image):
+    """Coarse-to-fine multi-scale search for the reference stamp.
+
+    Returns ``(score, box)`` where box is ``(x, y, w, h)`` in the coordinates
+    of ``target_image``, or ``None`` when nothing could be matched.
+    """
+    gray_doc = cv2.cvtColor(target_image, cv2.COLOR_BGR2GRAY)
+    doc_factor = MATCH_MAX_DIM / max(gray_doc.shape[:2])
+    interpolation = cv2.INTER_AREA if doc_factor < 1 else cv2.INTER_LINEAR
+    fine_doc = cv2.resize(gray_doc, None, fx=doc_factor, fy=doc_factor, interpolation=interpolation)
+    coarse_doc = cv2.resize(fine_doc, None, fx=COARSE_FACTOR, fy=COARSE_FACTOR, interpolation=cv2.INTER_AREA)
+    fine_edges = _edges(fine_doc)
+    coarse_edges = _edges(coarse_doc)
+
+    # Rank every scale on the cheap coarse level first
+    candidates = []
+    for template in stamp_templates:
+        score, loc = _best_match(coarse_edges, template['coarse'])
+        if score > -1.0:
+            candidates.append((score, loc, template))
+    candidates.sort(key=lambda c: c[0], reverse=True)
+
+    best_score, best_box = -1.0, None
+    for coarse_score, (cx, cy), template in candidates[:STAMP_REFINE_CANDIDATES]:
+        # Refine inside a window around the coarse hit at full working resolution
+        th, tw = template['fine'].shape
+        margin = int(2 / COARSE_FACTOR) + 4
+        x0 = max(int(cx / COARSE_FACTOR) - margin, 0)
+        y0 = max(int(cy / COARSE_FACTOR) - margin, 0)
+        window = fine_edges[y0:y0 + th + 2 * margin, x0:x0 + tw + 2 * margin]
+        score, (x, y) = _best_match(window, template['fine'])
+        logger.info(f"Stamp scale {template['scale']:.2f}: coarse {coarse_score:.3f}, refined {score:.3f}")
+
+        if score > best_score:
+            best_score = score
+            best_box = tuple(int(round(v / doc_factor)) for v in (x0 + x, y0 + y, tw, th))
+        if best_score >= STAMP_CONFIDENT_SCORE:
+            break
+
+    return best_score, best_box
+
 def is_stamp_present(target_image):
+    """True or False for a completed check, None if it could not be run"""
     try:
-        if reference_image is None:
+        if not stamp_templates:
             logger.error("Reference image not available.")
-            return False
-
-        # Convert to grayscale and apply Canny edges
-        gray_doc = cv2.cvtColor(target_image, cv2.COLOR_BGR2GRAY)
-        gray_stamp = cv2.cvtColor(reference_image, cv2.COLOR_BGR2GRAY)
+            return None
 
-        doc_edges = cv2.Canny(gray_doc, 50, 200)
-        stamp_edges = cv2.Canny(gray_stamp, 50, 200)
-
-        result = cv2.matchTemplate(doc_edges, stamp_edges, cv2.TM_CCOEFF_NORMED)
-        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        max_val, _ = match_stamp(target_image)
 
         logger.info(f"Template match score: {max_val:.3f}")
+        metrics.observe_stamp_score(max_val)
 
         # Threshold for detection
-        if max_val > 0.05:
+        if max_val > STAMP_MATCH_THRESHOLD:
             logger.info("✅ Stamp detected in image.")
             return True
         else:
@@ -57,24 +205,93 @@ def is_stamp_present(target_image):
 
     except Exception as e:
         logger.error(f"Error in stamp detection: {str(e)}", exc_info=True)
-        return False
+        return None
+
+def prepare_for_ocr(image):
+    """Grayscale, resize to the target DPI and binarize a document photo"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    target = OCR_TARGET_DPI * OCR_PAGE_INCHES
+    factor = target / max(gray.shape[:2])
+    interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_CUBIC
+    gray = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=interpolation)
+    # Adaptive thresholding copes with the uneven lighting of phone photos
+    return cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15
+    )
+
+def find_text_regions(binary):
+    """Boxes (x, y, w, h) of the largest likely text blocks, top to bottom"""
+    height, width = binary.shape
+    # Smear characters into lines, then lines into blocks
+    ink = cv2.bitwise_not(binary)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 40, 9), max(height // 200, 3)))
+    blocks = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(blocks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    regions = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        # Skip specks, rules and borders that can't hold a keyword line
+        if w < width * 0.1 or h < 12 or w * h > width * height * 0.8:
+            continue
+        pad = 10
+        x0, y0 = max(x - pad, 0), max(y - pad, 0)
+        regions.append((x0, y0, min(w + 2 * pad, width - x0), min(h + 2 * pad, height - y0)))
+    regions.sort(key=lambda r: r[2] * r[3], reverse=True)
+    # The header usually sits at the top of the page, so read top-down
+    return sorted(regions[:OCR_MAX_REGIONS], key=lambda r: r[1])
+
+def _ocr_text(image):
+    return ocr_engine.image_to_string(image)
 
-def contains_required_keywords(image):
+def _find_keyword(text):
+    text = text.lower()
+    return next((k for k in REQUIRED_KEYWORDS if k.lower() in text), None)
+
+def contains_required_keywords(image, cancelled=None):
+    """True or False for a completed check, None if OCR failed or was cancelled"""
     try:
-        config = r'--oem 3 --psm 6'
-        text = pytesseract.image_to_string(image, config=config)
-        logger.info("OCR text extracted")
+        binary = prepare_for_ocr(image)
+        regions = find_text_regions(binary)
+        crops = [binary[y:y + h, x:x + w] for x, y, w, h in regions]
+        # Only when the layout analysis found nothing; a page whose regions
+        # hold no keyword is rejected without reading it all a second time
+        if OCR_FULL_PAGE_FALLBACK and not crops:
+            crops.append(binary)
+
+        for i, crop in enumerate(crops):
+            # The stamp check may already have failed while this call was running
+            if cancelled is not None and cancelled.is_set():
+                logger.info("OCR skipped: verification already failed")
+                return None
 
-        keywords = ["Ministry of Agriculture", "State of Palestine"]
-        found = [k for k in keywords if k.lower() in text.lower()]
-        logger.info(f"Keywords found: {found}")
+            found = _find_keyword(_ocr_text(crop))
+            if found is not None:
+                logger.info(f"Keyword found in OCR region {i + 1}/{len(crops)}: {found}")
+                return True
 
-        return len(found) > 0
+        logger.info(f"No keyword found in {len(crops)} OCR regions")
+        return False
     except Exception as e:
         logger.error(f"OCR error: {str(e)}", exc_info=True)
-        return False
+        return None
+
+def _timed(func, *args):
+    """Run func and return (result, elapsed milliseconds)"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, round((time.perf_counter() - start) * 1000, 1)
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({
+        'isValid': False,
+        'message': f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"
+    }), 413
 
 @app.route('/verify-license', methods=['POST'])
+@admit(admission_gate, retry_after=RETRY_AFTER_SECONDS,
+       body={'isValid': False, 'message': 'Server busy, retry later'})
 def verify_license():
     try:
         logger.info("Received request for license verification.")
@@ -93,29 +310,80 @@ def verify_license():
         if file.filename == '':
             return jsonify({'isValid': False, 'message': 'No selected file'}), 400
 
-        file_bytes = np.frombuffer(file.read(), np.uint8)
-        image = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
+        request_start = time.perf_counter()
+        timings = {}
+
+        raw, timings['read_ms'] = _timed(read_upload, file, MAX_UPLOAD_BYTES)
+        check_dimensions(raw, MAX_IMAGE_PIXELS)
+        image, timings['decode_ms'] = _timed(decode_bgr, raw, DECODE_MIN_DIM)
 
         if image is None:
             return jsonify({'isValid': False, 'message': 'Invalid image file'}), 400
 
         logger.info(f"Image shape: {image.shape}")
 
-        # Check for stamp and keywords
-        stamp_ok = is_stamp_present(image)
-        keywords_ok = contains_required_keywords(image)
+        image_hash, timings['hash_ms'] = _timed(perceptual_hash, image)
+        cached, distance = verification_cache.get(image_hash)
+        metrics.observe_cache(distance)
+        if cached is not None:
+            logger.info(f"Verification cache hit (distance {distance})")
+            cached['cached'] = True
+            timings['total_ms'] = round((time.perf_counter() - request_start) * 1000, 1)
+            cached['timings'] = timings
+            metrics.observe_timings(timings)
+            metrics.observe_verdict(cached['isValid'], cached=True)
+            return jsonify(cached), 200
+
+        # Check for stamp and keywords in parallel
+        ocr_cancelled = threading.Event()
+        stamp_future = verify_executor.submit(_timed, is_stamp_present, image)
+        ocr_future = verify_executor.submit(_timed, contains_required_keywords, image, ocr_cancelled)
+
+        stamp_ok, timings['stamp_ms'] = stamp_future.result()
+
+        def respond(body, status=200):
+            # A check that failed to run says nothing about the document, so
+            # only verdicts from clean runs are cached
+            if status == 200:
+                verification_cache.put(image_hash, body)
+                metrics.observe_verdict(body['isValid'], cached=False)
+            timings['total_ms'] = round((time.perf_counter() - request_start) * 1000, 1)
+            body['timings'] = timings
+            logger.info(f"Verification timings: {timings}")
+            metrics.observe_timings(timings)
+            return jsonify(body), status
+
+        if stamp_ok is None:
+            ocr_cancelled.set()
+            ocr_future.cancel()
+            timings['ocr_ms'] = None
+            return respond({'isValid': False, 'message': 'Stamp check failed, please retry'}, 503)
 
         if not stamp_ok:
-            return jsonify({'isValid': False, 'message': 'Official stamp not detected'}), 200
+            # The answer is already negative; don't wait on OCR. A running
+            # Tesseract call finishes in the background and is discarded.
+            ocr_cancelled.set()
+            ocr_future.cancel()
+            timings['ocr_ms'] = None
+            return respond({'isValid': False, 'message': 'Official stamp not detected'})
+
+        keywords_ok, timings['ocr_ms'] = ocr_future.result()
+
+        if keywords_ok is None:
+            return respond({'isValid': False, 'message': 'Text recognition failed, please retry'}, 503)
 
         if not keywords_ok:
-            return jsonify({'isValid': False, 'message': 'Required keywords not found'}), 200
+            return respond({'isValid': False, 'message': 'Required keywords not found'})
 
-        return jsonify({
+        return respond({
             'isValid': True,
             'message': 'Stamp and required keywords detected'
         })
 
+    except RequestEntityTooLarge as e:
+        return upload_too_large(e)
+    except UploadRejected as e:
+        return jsonify({'isValid': False, 'message': str(e)}), e.status
     except Exception as e:
         logger.error(f"Verification error: {str(e)}", exc_info=True)
         return jsonify({
@@ -124,6 +392,26 @@ def verify_license():
             'error': str(e)
         }), 500
 
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(verification_cache.stats())
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(admission_gate.stats())
+
+@app.route('/health', methods=['GET'])
+def health():
+    ready = warmed_up and reference_image is not None
+    return jsonify({
+        'status': 'ok' if ready else 'not_ready',
+        'warmed_up': warmed_up,
+        'reference_loaded': reference_image is not None,
+        'ocr_backend': ocr_engine.backend,
+        'pid': os.getpid()
+    }), 200 if ready else 503
+
 if __name__ == '__main__':
+    warm_up()
     app.run(host='0.0.0.0', port=5001, debug=True)
 
@@ -0,0 +1,33 @@
+from prometheus_client import Counter, Histogram
+from observability import LATENCY_BUCKETS, instrument
+
+# Stages of /verify-license, named after the keys of the response "timings"
+STAGE_SECONDS = Histogram('license_stage_seconds', 'Time spent in each verification stage', ['stage'],
+                          buckets=(0.001, 0.0025) + LATENCY_BUCKETS)
+CACHE_LOOKUPS = Counter('license_cache_lookups_total', 'Verification cache lookups', ['result'])
+STAMP_SCORE = Histogram('license_stamp_match_score', 'Best template match score per document',
+                        buckets=(0.0, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.6, 0.8, 1.0))
+VERDICTS = Counter('license_verdicts_total', 'Verification outcomes', ['valid', 'cached'])
+
+
+def observe_timings(timings):
+    """Record a request's ``timings`` dict (stage name -> milliseconds or None)"""
+    for key, ms in timings.items():
+        if ms is not None and key.endswith('_ms'):
+            STAGE_SECONDS.labels(key[:-3]).observe(ms / 1000)
+
+
+def observe_cache(distance):
+    if distance is None:
+        result = 'miss'
+    else:
+        result = 'exact' if distance == 0 else 'near'
+    CACHE_LOOKUPS.labels(result).inc()
+
+
+def observe_stamp_score(score):
+    STAMP_SCORE.observe(max(score, 0.0))
+
+
+def observe_verdict(valid, cached):
+    VERDICTS.labels(str(bool(valid)).lower(), str(bool(cached)).lower()).inc()
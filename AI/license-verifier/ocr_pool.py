@@ -0,0 +1,101 @@
+import logging
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+import pytesseract
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+
+class TesseractPool:
+    """Pool of long-lived Tesseract engines shared by the request threads.
+
+    With tesserocr installed each engine is a ``PyTessBaseAPI`` that keeps its
+    language data loaded and takes images straight from memory, so a call
+    costs only the recognition itself. Without it (e.g. on Windows) the pool
+    falls back to pytesseract, which starts a tesseract process per call;
+    ``size`` then bounds how many of those processes run at once.
+
+    Engines are created lazily in the process that uses them, so the pool
+    can be built before gunicorn forks its workers.
+    """
+
+    def __init__(self, size=2, lang='eng', psm=6, oem=3, tessdata_path=None, dpi=None):
+        if size < 1:
+            raise ValueError("OCR pool size must be at least 1")
+        self.size = size
+        self.lang = lang
+        self.psm = psm
+        self.oem = oem
+        # Images are resized to a known DPI, so Tesseract needn't guess it
+        self.dpi = dpi
+        self.tessdata_path = tessdata_path or os.environ.get('TESSDATA_PREFIX')
+        self.backend = 'tesserocr' if tesserocr is not None else 'pytesseract'
+        self._engines = None
+        self._created = 0
+        self._pid = None
+        self._lock = threading.Lock()
+        self._processes = threading.BoundedSemaphore(size)
+
+        if tesserocr is None:
+            logger.warning("tesserocr not installed; OCR falls back to one tesseract process per call")
+
+    def _new_engine(self):
+        kwargs = {'lang': self.lang, 'psm': self.psm, 'oem': self.oem}
+        if self.tessdata_path:
+            kwargs['path'] = self.tessdata_path
+        return tesserocr.PyTessBaseAPI(**kwargs)
+
+    def _acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Engines are never shared across fork
+                self._engines = queue.Queue()
+                self._created = 0
+                self._pid = os.getpid()
+            if self._engines.empty() and self._created < self.size:
+                self._created += 1
+                return self._new_engine()
+        return self._engines.get()
+
+    def _release(self, engine):
+        self._engines.put(engine)
+
+    def image_to_string(self, image):
+        """OCR a uint8 numpy image (grayscale or BGR) without touching disk"""
+        if self.backend == 'pytesseract':
+            config = f'--oem {self.oem} --psm {self.psm}' + (f' --dpi {self.dpi}' if self.dpi else '')
+            with self._processes:
+                return pytesseract.image_to_string(image, config=config)
+
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        image = np.ascontiguousarray(image)
+        height, width = image.shape[:2]
+        channels = 1 if image.ndim == 2 else image.shape[2]
+
+        engine = self._acquire()
+        try:
+            engine.SetImageBytes(image.tobytes(), width, height, channels, width * channels)
+            if self.dpi:
+                engine.SetSourceResolution(self.dpi)
+            return engine.GetUTF8Text()
+        finally:
+            engine.Clear()
+            self._release(engine)
+
+    def warm_up(self):
+        """Create every engine up front so no request pays the language-data load"""
+        if self.backend != 'tesserocr':
+            return
+        engines = [self._acquire() for _ in range(self.size)]
+        for engine in engines:
+            self._release(engine)
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def perceptual_hash(image):
+    """64-bit DCT perceptual hash of a decoded BGR or grayscale image.
+
+    Re-encoding, resizing and small lighting changes flip only a few bits,
+    so near-identical photos end up a small Hamming distance apart.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # Skip the DC term, which only tracks overall brightness
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+class VerificationCache:
+    """Bounded LRU store of verification verdicts keyed by perceptual hash.
+
+    A lookup matches the closest stored hash within ``max_distance`` bits;
+    0, the default, only accepts exact hash matches. A near match only ever
+    reuses a rejection: a different document that happens to hash close to
+    a valid one must not inherit its ``isValid: true``. The Hamming distance
+    to every entry is computed in one vectorized pass, which stays cheap for
+    a few thousand entries.
+    """
+
+    def __init__(self, max_entries=2048, max_distance=0, ttl=24 * 3600):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _closest(self, image_hash):
+        if image_hash in self._entries:
+            return image_hash, 0
+        if not self._entries or self.max_distance <= 0:
+            return None, None
+        keys = np.fromiter(self._entries.keys(), dtype=np.uint64, count=len(self._entries))
+        xor = np.bitwise_xor(keys, np.uint64(image_hash))
+        distances = np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+        best = int(np.argmin(distances))
+        return int(keys[best]), int(distances[best])
+
+    def get(self, image_hash):
+        """Return ``(verdict, distance)`` for the closest match, or ``(None, None)``"""
+        with self._lock:
+            match, distance = self._closest(image_hash)
+            if match is not None and time.monotonic() - self._entries[match][0] > self.ttl:
+                del self._entries[match]
+                match = None
+            if (match is None or distance > self.max_distance or
+                    (distance > 0 and self._entries[match][1].get('isValid'))):
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(match)
+            if distance == 0:
+                self.exact_hits += 1
+            else:
+                self.near_hits += 1
+            return dict(self._entries[match][1]), distance
+
+    def put(self, image_hash, verdict):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[image_hash] = (time.monotonic(), dict(verdict))
+            self._entries.move_to_end(image_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.near_hits
+            lookups = hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'max_distance': self.max_distance,
+                'exact_hits': self.exact_hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': hits / lookups if lookups else 0.0
+            }
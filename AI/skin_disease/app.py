@@ -1,13 +1,128 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import torch
 from predict import SkinDiseaseClassifier
+from batcher import BatchScheduler
+from cache import PredictionCache, content_hash
+from reloader import ModelReloader
+import hmac
 import os
+import sys
+import tempfile
+import time
+
+# Code shared with the license verifier lives in AI/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import metrics
+from limits import AdmissionGate, UploadRejected, admit, check_dimensions, read_upload
+
+# Upload limits, enforced while the body is read and before any pixel is decoded
+MAX_UPLOAD_BYTES = int(float(os.environ.get('MAX_UPLOAD_MB', 10)) * 1024 * 1024)
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 40_000_000))
+# Requests allowed in decode/queue/inference at once per worker; keep it below
+# gunicorn's WORKER_THREADS so /health and /metrics always get a thread, and at
+# or above BATCH_MAX_SIZE so a full micro-batch can actually form
+MAX_PENDING_REQUESTS = int(os.environ.get('MAX_PENDING_REQUESTS', 8))
+RETRY_AFTER_SECONDS = int(os.environ.get('RETRY_AFTER_SECONDS', 1))
 
 app = Flask(__name__)
 CORS(app)
+# Werkzeug refuses larger bodies outright; leave room for the form fields
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES + 64 * 1024
+# Request counts/latency on /metrics; PROFILE_SAMPLE_RATE turns on cProfile sampling
+metrics.instrument(app, 'skin')
+
+# Initialize classifier; MODEL_PATH may point at an exported artifact from
+# export_model.py (model.slim.pt, model.ts.pt, model_int8_static.ts.pt,
+# model.onnx, ...). Eager checkpoints are memory-mapped rather than read.
+MODEL_PATH = os.environ.get('MODEL_PATH', 'best_model.pth')
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'auto')
+# Hot reload of MODEL_PATH: POST /admin/reload (needs ADMIN_TOKEN), or
+# automatically when the file changes if MODEL_WATCH_INTERVAL (seconds) is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+MODEL_WATCH_INTERVAL = float(os.environ.get('MODEL_WATCH_INTERVAL', 0))
+# A reloadable file may be rewritten in place, which would corrupt mapped
+# weights, so with reload enabled the weights are read into private memory
+MODEL_MMAP = not (ADMIN_TOKEN or MODEL_WATCH_INTERVAL > 0)
+# Optional cascade: a distilled student (train_model.py --distill-from) answers
+# first and only images it is less than CASCADE_THRESHOLD sure about reach
+# MODEL_PATH. Pick the threshold with cascade_report.py.
+CASCADE_OPTIONS = {
+    'student_path': os.environ.get('CASCADE_MODEL_PATH') or None,
+    'cascade_threshold': float(os.environ.get('CASCADE_THRESHOLD', 0.9))
+}
+classifier = SkinDiseaseClassifier(MODEL_PATH, backend=MODEL_BACKEND, mmap=MODEL_MMAP, **CASCADE_OPTIONS)
+
+# Concurrent requests are grouped into micro-batches; max wait bounds the
+# extra queueing latency a single request can pay
+batcher = BatchScheduler(
+    classifier,
+    max_batch_size=min(int(os.environ.get('BATCH_MAX_SIZE', 8)), MAX_PENDING_REQUESTS),
+    max_wait_ms=float(os.environ.get('BATCH_MAX_WAIT_MS', 5)),
+    observer=metrics
+)
+
+# Repeat uploads of the same photo skip the model entirely
+prediction_cache = PredictionCache(
+    max_entries=int(os.environ.get('PREDICTION_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('PREDICTION_CACHE_TTL', 3600))
+)
+
+admission_gate = AdmissionGate(MAX_PENDING_REQUESTS)
+
+# Similar-case search: with SIMILARITY_INDEX_DIR set, the embedding of every
+# analyzed upload is added to an on-disk index (shared by all workers) that
+# /similar searches. Seed it with training images via score_images.py --index.
+SIMILARITY_INDEX_DIR = os.environ.get('SIMILARITY_INDEX_DIR')
+MAX_SIMILAR_RESULTS = int(os.environ.get('MAX_SIMILAR_RESULTS', 50))
+similarity_index = None
+if SIMILARITY_INDEX_DIR and classifier.embedding_version is not None:
+    from vector_index import VectorIndex
+    similarity_index = VectorIndex(SIMILARITY_INDEX_DIR, classifier.embedding_dim, classifier.embedding_version)
+
+def index_ready(model):
+    """True when ``model``'s embeddings are comparable with the ones in the index"""
+    return similarity_index is not None and model.embedding_version == similarity_index.version
+
+# Set once this process has run a warm-up inference; reported by /health
+warmed_up = False
+
+def warm_up_classifier(model):
+    dummy = torch.zeros(3, 224, 224)
+    for species in model.species_ids:
+        model.predict_tensors([dummy], [species])
+    # In cascade mode the dummy may never reach the full model
+    model.forward([dummy])
+
+def warm_up():
+    """Run one dummy inference so the first real request skips lazy init costs"""
+    global warmed_up
+    warm_up_classifier(classifier)
+    warmed_up = True
+
+def swap_model(new_classifier):
+    """Point new requests at a loaded, warmed-up classifier.
+
+    Requests already running hold a reference to the old one and finish on
+    it; the prediction cache drops old entries on the next lookup because
+    the model version changed.
+    """
+    global classifier
+    classifier = new_classifier
+    batcher.classifier = new_classifier
 
-# Initialize classifier
-classifier = SkinDiseaseClassifier('best_model.pth')
+# /admin/reload touches a trigger file that the watcher of every gunicorn
+# worker polls, so all workers reload, not just the one serving the request
+reloader = ModelReloader(
+    MODEL_PATH,
+    backend=MODEL_BACKEND,
+    warm_up=warm_up_classifier,
+    on_swap=swap_model,
+    poll_interval=MODEL_WATCH_INTERVAL,
+    options=dict(CASCADE_OPTIONS, mmap=MODEL_MMAP),
+    trigger_path=os.environ.get('MODEL_RELOAD_TRIGGER',
+                                os.path.join(tempfile.gettempdir(), 'skin_disease_reload')) if ADMIN_TOKEN else None
+)
 
 def allowed_file(filename):
     return '.' in filename and filename.lower().endswith(('.png', '.jpg', '.jpeg'))
@@ -29,31 +144,79 @@ def generate_recommendation(condition, confidence, species):
         return f"Recommended: {base_recommendation} Monitor closely."
     return base_recommendation
 
-@app.route('/predict', methods=['POST'])
-def predict():
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"}), 413
+
+def image_form():
+    """(file, species, None) from the upload form, or (None, None, error response)"""
     if 'image' not in request.files:
-        return jsonify({'error': 'No image provided'}), 400
+        return None, None, (jsonify({'error': 'No image provided'}), 400)
         
     file = request.files['image']
     species = request.form.get('species', '').lower()
     
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return None, None, (jsonify({'error': 'No selected file'}), 400)
     if species not in ['dog', 'cat']:
-        return jsonify({'error': 'Invalid species. Must be "dog" or "cat"'}), 400
+        return None, None, (jsonify({'error': 'Invalid species. Must be "dog" or "cat"'}), 400)
     if not allowed_file(file.filename):
-        return jsonify({'error': 'Invalid file type'}), 400
+        return None, None, (jsonify({'error': 'Invalid file type'}), 400)
+    return file, species, None
 
+def add_to_index(image_hash, species, result, model):
+    """Index an analyzed upload; a failure here never fails the prediction"""
+    embedding = result.pop('embedding', None)
+    if embedding is None:
+        return
     try:
-        # Save temporary file
-        temp_path = 'temp_pred.jpg'
-        file.save(temp_path)
-        
-        # Make prediction
-        result = classifier.predict(temp_path, species)
-        
-        if 'error' in result:
-            return jsonify(result), 400
+        similarity_index.add([embedding], [{
+            'id': image_hash,
+            'species': species,
+            'prediction': result['prediction'],
+            'confidence': result['confidence'],
+            'model_version': model.model_version,
+            'source': 'upload',
+            'added': time.time()
+        }])
+        result['embedding_id'] = image_hash
+    except Exception as e:
+        app.logger.warning(f"Could not add {image_hash} to the similarity index: {e}")
+
+@app.route('/predict', methods=['POST'])
+@admit(admission_gate, retry_after=RETRY_AFTER_SECONDS)
+def predict():
+    file, species, error = image_form()
+    if error is not None:
+        return error
+
+    try:
+        # Decode straight from the upload; nothing is written to disk
+        start = time.perf_counter()
+        image_bytes = read_upload(file, MAX_UPLOAD_BYTES)
+        check_dimensions(image_bytes, MAX_IMAGE_PIXELS)
+        metrics.observe_stage('upload_read', time.perf_counter() - start)
+        image_hash = content_hash(image_bytes)
+        # One model for the whole request, even if a reload swaps it meanwhile
+        current = classifier
+        model_version = current.model_version
+
+        result = prediction_cache.get(image_hash, species, model_version)
+        metrics.observe_cache(result is not None)
+        if result is None:
+            # A photo already in the index (e.g. after a cache eviction) isn't added again
+            indexing = index_ready(current)
+            indexed = indexing and image_hash in similarity_index
+            result = batcher.predict(image_bytes, species, current, embedding=indexing and not indexed)
+            
+            if 'error' in result:
+                return jsonify(result), 400
+
+            if indexed:
+                result['embedding_id'] = image_hash
+            elif indexing:
+                add_to_index(image_hash, species, result, current)
+            prediction_cache.put(image_hash, species, model_version, result)
             
         # Add recommendation
         result['recommendation'] = generate_recommendation(
@@ -64,11 +227,108 @@ def predict():
         
         return jsonify(result)
         
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/similar', methods=['POST'])
+@admit(admission_gate, retry_after=RETRY_AFTER_SECONDS)
+def similar():
+    """Past cases that look most like the uploaded image, most similar first.
+
+    Form fields: ``image``, ``species``, optional ``k`` (default 5) and
+    ``scope`` (``species`` to search the same species only, the default, or
+    ``all``). The query image itself is neither added to the index nor
+    returned, even if it was indexed by an earlier /predict.
+    """
+    current = classifier
+    if similarity_index is None:
+        return jsonify({'error': 'Similarity search is not enabled'}), 404
+    if not index_ready(current):
+        return jsonify({'error': 'The similarity index was built with a different model; rebuild it'}), 409
+
+    file, species, error = image_form()
+    if error is not None:
+        return error
+    try:
+        k = min(int(request.form.get('k', 5)), MAX_SIMILAR_RESULTS)
+    except ValueError:
+        return jsonify({'error': 'k must be an integer'}), 400
+    scope = request.form.get('scope', 'species')
+
+    try:
+        image_bytes = read_upload(file, MAX_UPLOAD_BYTES)
+        check_dimensions(image_bytes, MAX_IMAGE_PIXELS)
+        result = batcher.predict(image_bytes, species, current, embedding=True)
+        if 'error' in result:
+            return jsonify(result), 400
+
+        start = time.perf_counter()
+        # One extra so dropping the query's own entry still leaves k
+        image_hash = content_hash(image_bytes)
+        matches = similarity_index.search(result.pop('embedding'), k=k + 1,
+                                          species=species if scope == 'species' else None)
+        matches = [(score, meta) for score, meta in matches if meta.get('id') != image_hash][:k]
+        elapsed = time.perf_counter() - start
+        metrics.observe_stage('similarity_search', elapsed)
+
+        return jsonify({
+            'species': species,
+            'prediction': result['prediction'],
+            'confidence': result['confidence'],
+            'similar': [dict(meta, score=score) for score, meta in matches],
+            'search_ms': 1000 * elapsed,
+            'index_entries': len(similarity_index)
+        })
+
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+
+@app.route('/similar/stats', methods=['GET'])
+def similar_stats():
+    if similarity_index is None:
+        return jsonify({'error': 'Similarity search is not enabled'}), 404
+    return jsonify(dict(similarity_index.stats(), model_compatible=index_ready(classifier)))
+
+@app.route('/health', methods=['GET'])
+def health():
+    status = {
+        'status': 'ok' if warmed_up else 'warming_up',
+        'model_version': classifier.model_version,
+        'backend': classifier.backend,
+        'reload': reloader.state,
+        'pid': os.getpid()
+    }
+    return jsonify(status), 200 if warmed_up else 503
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(prediction_cache.stats())
+
+@app.route('/admin/reload', methods=['GET', 'POST'])
+def admin_reload():
+    # Disabled unless a token is configured
+    token = request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+        return jsonify({'error': 'Forbidden'}), 403
+    if request.method == 'GET':
+        return jsonify(dict(reloader.status(), model_version=classifier.model_version))
+    if not reloader.request_reload():
+        return jsonify({'error': 'A reload is already in progress'}), 409
+    return jsonify({'status': 'reloading', 'model_version': classifier.model_version}), 202
+
+@app.route('/cascade/stats', methods=['GET'])
+def cascade_stats():
+    return jsonify(classifier.cascade_stats())
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(admission_gate.stats())
 
 if __name__ == '__main__':
+    warm_up()
+    reloader.start_watching()
     app.run(host='0.0.0.0', port=5006, debug=True)
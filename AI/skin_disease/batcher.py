@@ -0,0 +1,141 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class BatchScheduler:
+    """Collects concurrent predictions into micro-batches for one forward pass.
+
+    Callers preprocess their own image in the request thread, then wait while
+    a single worker thread gathers up to ``max_batch_size`` pending requests
+    (waiting at most ``max_wait_ms`` after the first one arrives) and scores
+    them together with ``SkinDiseaseClassifier.predict_tensors``.
+
+    ``observer``, when given, receives per-stage timings and batch sizes
+    (see ``metrics.py``); the scheduler works the same without it.
+    """
+
+    def __init__(self, classifier, max_batch_size=8, max_wait_ms=5, timeout=30, observer=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.classifier = classifier
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self.observer = observer
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # The worker thread does not survive fork, so restart it in child processes
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='batch-scheduler', daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _notify(self, method, *args):
+        # A failing observer must never take down the scheduler thread
+        if self.observer is None:
+            return
+        try:
+            getattr(self.observer, method)(*args)
+        except Exception as e:
+            logger.warning(f"Batch observer {method} failed: {e}")
+
+    def _observe(self, stage, seconds):
+        self._notify('observe_stage', stage, seconds)
+
+    def _score(self, classifier, batch):
+        start = time.perf_counter()
+        tensors = [item[0] for item in batch]
+        species_list = [item[1] for item in batch]
+        self._notify('observe_batch', len(batch), self._queue.qsize())
+        for item in batch:
+            self._observe('queue_wait', start - item[3])
+        # One request asking for embeddings sends the whole group through the full model
+        embeddings = any(item[5] for item in batch)
+        try:
+            if embeddings:
+                outputs, features = classifier.forward(tensors, species_list, embeddings=True)
+            else:
+                outputs = classifier.forward(tensors, species_list)
+            forward_done = time.perf_counter()
+            results = classifier.postprocess(outputs, species_list)
+            if embeddings:
+                results = classifier.attach_embeddings(results, features)
+            self._observe('forward', forward_done - start)
+            self._observe('postprocess', time.perf_counter() - forward_done)
+        except Exception as e:
+            results = [{'error': str(e)} for _ in batch]
+        for item, result in zip(batch, results):
+            if not item[5]:
+                result.pop('embedding', None)
+            item[2].set_result(result)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # Right after a model swap a batch can mix requests for the old and
+            # the new model; each request is scored by the model it started on
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item[4]), (item[4], []))[1].append(item)
+            for classifier, items in groups.values():
+                self._score(classifier, items)
+
+    def submit(self, tensor, species, classifier=None, embedding=False):
+        """Queue a preprocessed image tensor and return a Future for its result"""
+        self._ensure_started()
+        future = Future()
+        classifier = classifier or self.classifier
+        self._queue.put((tensor, species, future, time.perf_counter(), classifier, embedding))
+        self._notify('set_queue_depth', self._queue.qsize())
+        return future
+
+    def predict(self, image, species, classifier=None, embedding=False):
+        """Drop-in replacement for ``SkinDiseaseClassifier.predict`` that batches.
+
+        ``classifier`` pins the request to a specific model; by default it is
+        whichever model the scheduler holds when the request starts. With
+        ``embedding`` the result also carries the image's embedding.
+        """
+        classifier = classifier or self.classifier
+        try:
+            start = time.perf_counter()
+            decoded = classifier.load_image(image)
+            decode_done = time.perf_counter()
+            tensor = classifier.transform(decoded)
+            self._observe('decode', decode_done - start)
+            self._observe('transform', time.perf_counter() - decode_done)
+            return self.submit(tensor, species, classifier, embedding).result(timeout=self.timeout)
+        except FutureTimeoutError:
+            return {'error': 'Prediction timed out'}
+        except Exception as e:
+            return {'error': str(e)}
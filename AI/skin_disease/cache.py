@@ -0,0 +1,80 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def content_hash(data):
+    """SHA-256 of raw upload bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class PredictionCache:
+    """Thread-safe LRU cache of prediction results with a per-entry TTL.
+
+    Keys are ``(image hash, species, model version)``. Entries from another
+    model version are never returned, and the first lookup with a new
+    version drops everything cached for the old one.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _check_version(self, model_version):
+        if model_version != self._model_version:
+            self._entries.clear()
+            self._model_version = model_version
+
+    def get(self, image_hash, species, model_version):
+        """Return a copy of the cached result, or None on a miss"""
+        key = (image_hash, species, model_version)
+        with self._lock:
+            self._check_version(model_version)
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, image_hash, species, model_version, result):
+        if self.max_entries <= 0:
+            return
+        key = (image_hash, species, model_version)
+        with self._lock:
+            self._check_version(model_version)
+            self._entries[key] = (time.monotonic(), copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'model_version': self._model_version
+            }
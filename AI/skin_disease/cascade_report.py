@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import time
+
+import torch
+
+from export_model import image_loader
+from predict import SkinDiseaseClassifier
+
+DEFAULT_THRESHOLDS = [0.5, 0.6, 0.7, 0.75, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99]
+
+
+def score_split(classifier, valid_dir, batch_size):
+    """Full-model and student logits for every image in an ImageFolder split.
+
+    Also returns the per-image forward time of each model at this batch size,
+    which the threshold sweep uses to estimate cascade cost.
+    """
+    loader, folder_classes = image_loader(valid_dir, classifier.transform, batch_size)
+    species_of = [c.split('_', 1)[0] for c in folder_classes]
+
+    full, student, species_list, labels = [], [], [], []
+    full_time = student_time = 0.0
+    for inputs, targets in loader:
+        tensors = list(inputs)
+        start = time.perf_counter()
+        full.append(classifier.forward(tensors))
+        full_done = time.perf_counter()
+        student.append(classifier.student.forward(tensors))
+        full_time += full_done - start
+        student_time += time.perf_counter() - full_done
+
+        species_list.extend(species_of[t] for t in targets.tolist())
+        labels.extend(folder_classes[t] for t in targets.tolist())
+
+    count = max(len(labels), 1)
+    return {
+        'full': torch.cat(full).float(),
+        'student': torch.cat(student).float(),
+        'species': species_list,
+        'labels': labels,
+        'full_ms': 1000 * full_time / count,
+        'student_ms': 1000 * student_time / count
+    }
+
+
+def predictions(classifier, outputs, species_list):
+    return [r.get('full_prediction') for r in classifier.postprocess(outputs, species_list)]
+
+
+def sweep(classifier, scores, thresholds):
+    """Escalation rate, agreement with the full model and accuracy per threshold"""
+    species_list, labels = scores['species'], scores['labels']
+    full_preds = predictions(classifier, scores['full'], species_list)
+    student_preds = predictions(classifier, scores['student'], species_list)
+    confidence = classifier.species_confidence(scores['student'], species_list).tolist()
+
+    rows = []
+    for threshold in thresholds:
+        escalated = [c < threshold for c in confidence]
+        preds = [f if e else s for f, s, e in zip(full_preds, student_preds, escalated)]
+        rate = sum(escalated) / len(labels)
+        rows.append({
+            'threshold': threshold,
+            'escalation_rate': rate,
+            'agreement': sum(p == f for p, f in zip(preds, full_preds)) / len(labels),
+            'accuracy': sum(p == l for p, l in zip(preds, labels)) / len(labels),
+            'est_ms_per_image': scores['student_ms'] + rate * scores['full_ms']
+        })
+    return rows
+
+
+def choose_threshold(rows, target_agreement):
+    """Lowest-escalation threshold that still agrees with the full model often enough"""
+    passing = [r for r in rows if r['agreement'] >= target_agreement]
+    if not passing:
+        return max(rows, key=lambda r: r['agreement'])
+    return min(passing, key=lambda r: (r['escalation_rate'], -r['agreement']))
+
+
+def measure_latency(classifier, scores, valid_dir, threshold, limit):
+    """Mean single-image latency of the full model alone and of the cascade"""
+    loader, _ = image_loader(valid_dir, classifier.transform, 1)
+    classifier.cascade_threshold = threshold
+    full_ms, cascade_ms, escalated = [], [], 0
+    for i, (inputs, _) in enumerate(loader):
+        if i >= limit:
+            break
+        tensors, species = list(inputs), [scores['species'][i]]
+
+        start = time.perf_counter()
+        classifier.forward(tensors)
+        full_ms.append(1000 * (time.perf_counter() - start))
+
+        before = classifier.cascade_stats()['escalated']
+        start = time.perf_counter()
+        classifier.forward(tensors, species)
+        cascade_ms.append(1000 * (time.perf_counter() - start))
+        escalated += classifier.cascade_stats()['escalated'] - before
+
+    count = max(len(full_ms), 1)
+    return {
+        'images': len(full_ms),
+        'full_mean_ms': sum(full_ms) / count,
+        'cascade_mean_ms': sum(cascade_ms) / count,
+        'escalation_rate': escalated / count
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the cascade threshold and report its cost and agreement')
+    parser.add_argument('--model', default='best_model.pth', help='Full model (any backend)')
+    parser.add_argument('--student', default='student_model.pth', help='Distilled student from train_model.py')
+    parser.add_argument('--valid-dir', default=os.path.join('data', 'valid'))
+    parser.add_argument('--thresholds', type=float, nargs='+', default=DEFAULT_THRESHOLDS)
+    parser.add_argument('--target-agreement', type=float, default=0.99,
+                        help='Minimum share of answers that must match the full model')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--latency-images', type=int, default=200,
+                        help='Images timed one at a time for the mean-latency comparison')
+    parser.add_argument('--output', default='cascade_report.json')
+    args = parser.parse_args()
+
+    classifier = SkinDiseaseClassifier(args.model, student_path=args.student)
+    # One untimed pass so lazy init doesn't land on the first measurement
+    dummy = torch.zeros(3, 224, 224)
+    classifier.forward([dummy])
+    classifier.student.forward([dummy])
+
+    print(f"Scoring {args.valid_dir} with both models...")
+    scores = score_split(classifier, args.valid_dir, args.batch_size)
+    rows = sweep(classifier, scores, sorted(args.thresholds))
+
+    print(f"{len(scores['labels'])} images; full model {scores['full_ms']:.2f} ms/image, "
+          f"student {scores['student_ms']:.2f} ms/image (batch {args.batch_size})")
+    print(f"{'threshold':>10} {'escalated':>10} {'agreement':>10} {'accuracy':>10} {'est ms':>8}")
+    for r in rows:
+        print(f"{r['threshold']:>10.3f} {r['escalation_rate']:>10.1%} {r['agreement']:>10.2%} "
+              f"{r['accuracy']:>10.2%} {r['est_ms_per_image']:>8.2f}")
+
+    chosen = choose_threshold(rows, args.target_agreement)
+    if chosen['agreement'] < args.target_agreement:
+        print(f"No threshold reaches {args.target_agreement:.2%} agreement; using the closest")
+
+    latency = measure_latency(classifier, scores, args.valid_dir, chosen['threshold'], args.latency_images)
+    print(f"Recommended CASCADE_THRESHOLD={chosen['threshold']}: "
+          f"{chosen['escalation_rate']:.1%} escalated, {chosen['agreement']:.2%} agreement, "
+          f"accuracy {chosen['accuracy']:.2%}")
+    print(f"Single-image latency over {latency['images']} images: full {latency['full_mean_ms']:.2f} ms, "
+          f"cascade {latency['cascade_mean_ms']:.2f} ms")
+
+    full_accuracy = sum(p == l for p, l in zip(predictions(classifier, scores['full'], scores['species']),
+                                               scores['labels'])) / len(scores['labels'])
+    report = {
+        'model': args.model,
+        'student': args.student,
+        'valid_dir': args.valid_dir,
+        'images': len(scores['labels']),
+        'full_accuracy': full_accuracy,
+        'full_ms_per_image': scores['full_ms'],
+        'student_ms_per_image': scores['student_ms'],
+        'target_agreement': args.target_agreement,
+        'recommended': chosen,
+        'latency': latency,
+        'thresholds': rows
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+import math
+import os
+import random
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class ResumableRandomSampler(Sampler):
+    """Shuffling sampler whose position can be saved and restored mid-epoch.
+
+    The order for each epoch is derived from ``seed + epoch``, so after a
+    restart the same permutation is rebuilt and iteration continues at
+    ``start_index`` instead of replaying samples already trained on.
+
+    For distributed training each of ``num_replicas`` processes builds the
+    same permutation and takes every ``num_replicas``-th index from
+    ``rank``, as DistributedSampler does; ``start_index`` then counts this
+    rank's samples.
+    """
+
+    def __init__(self, data_source, seed=0, num_replicas=1, rank=0):
+        if not 0 <= rank < num_replicas:
+            raise ValueError(f"rank must be in [0, {num_replicas})")
+        self.dataset_size = len(data_source)
+        self.num_replicas = num_replicas
+        self.rank = rank
+        # Every rank gets the same number of samples so they stay in lockstep
+        self.num_samples = math.ceil(self.dataset_size / num_replicas)
+        self.seed = seed
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def _permutation(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.randperm(self.dataset_size, generator=generator).tolist()
+        # Pad by wrapping around so the permutation splits evenly across ranks
+        total_size = self.num_samples * self.num_replicas
+        while len(indices) < total_size:
+            indices += indices[:total_size - len(indices)]
+        return indices[self.rank:total_size:self.num_replicas]
+
+    def __iter__(self):
+        return iter(self._permutation()[self.start_index:])
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+    def state_dict(self):
+        return {
+            'seed': self.seed,
+            'epoch': self.epoch,
+            'start_index': self.start_index,
+            'num_replicas': self.num_replicas,
+            'rank': self.rank
+        }
+
+
+class EarlyStopping:
+    """Stops training when the monitored validation metric stops improving"""
+
+    def __init__(self, patience=5, min_delta=0.0, monitor='loss'):
+        if monitor not in ('loss', 'acc'):
+            raise ValueError("monitor must be 'loss' or 'acc'")
+        self.patience = patience
+        self.min_delta = min_delta
+        self.monitor = monitor
+        self.best = None
+        self.bad_epochs = 0
+
+    def step(self, loss, acc):
+        """Record one epoch's validation result; returns True when training should stop"""
+        value = loss if self.monitor == 'loss' else acc
+        if self.best is None:
+            improved = True
+        elif self.monitor == 'loss':
+            improved = value < self.best - self.min_delta
+        else:
+            improved = value > self.best + self.min_delta
+
+        if improved:
+            self.best = value
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        return self.patience is not None and self.bad_epochs >= self.patience
+
+    def state_dict(self):
+        return {'best': self.best, 'bad_epochs': self.bad_epochs}
+
+    def load_state_dict(self, state):
+        self.best = state['best']
+        self.bad_epochs = state['bad_epochs']
+
+
+def rng_state():
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def save_training_state(path, **state):
+    """Write a full training checkpoint atomically, so a crash mid-write keeps the previous one"""
+    state['rng'] = rng_state()
+    tmp_path = path + '.tmp'
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_training_state(path, map_location='cpu'):
+    # The checkpoint holds RNG states and plain Python objects, not just tensors
+    state = torch.load(path, map_location=map_location, weights_only=False)
+    set_rng_state(state['rng'])
+    return state
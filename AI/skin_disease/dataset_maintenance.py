@@ -0,0 +1,244 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+try:
+    # Registers the AVIF decoder with Pillow when installed
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.avif', '.bmp', '.gif')
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+MANIFEST_NAME = '.manifest.json'
+
+
+def difference_hash(img, size=8):
+    """64-bit dHash: compares neighbouring pixels of a tiny grayscale thumbnail"""
+    small = img.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _jpeg_path(path):
+    base, ext = os.path.splitext(path)
+    target = base + '.jpg'
+    if os.path.exists(target):
+        # Don't overwrite a different image that already has the .jpg name
+        target = f"{base}_{ext.lstrip('.').lower()}.jpg"
+    return target
+
+
+def check_file(path, convert=True, remove_corrupt=True):
+    """Fully decode one file, optionally convert it to JPEG, and describe the result.
+
+    Runs in a worker process. Each file is opened and decoded exactly once.
+    """
+    record = {'path': path, 'status': 'ok'}
+    try:
+        with Image.open(path) as img:
+            # load() decodes every pixel, catching truncated files that verify() misses
+            img.load()
+            rgb = img.convert('RGB')
+            record['width'], record['height'] = img.size
+            is_jpeg = img.format == 'JPEG'
+
+        if convert and (not is_jpeg or not path.lower().endswith(JPEG_EXTENSIONS)):
+            new_path = _jpeg_path(path)
+            rgb.save(new_path, 'JPEG', quality=95)
+            os.remove(path)
+            record.update(path=new_path, status='converted', converted_from=path)
+
+        record['dhash'] = difference_hash(rgb)
+        record['sha256'] = sha256_file(record['path'])
+    except Exception as e:
+        record.update(status='corrupt', error=str(e))
+        if remove_corrupt:
+            try:
+                os.remove(path)
+                record['status'] = 'removed'
+            except OSError:
+                pass
+    return record
+
+
+def load_manifest(root):
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(root, manifest):
+    path = os.path.join(root, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def scan(root):
+    """Yield (relative path, size, mtime) for every image file under root"""
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            yield os.path.relpath(path, root), stat.st_size, stat.st_mtime
+
+
+def update_manifest(root, workers=None, convert=True, remove_corrupt=True):
+    """Process new or changed files in parallel and return (manifest, counts)"""
+    manifest = load_manifest(root)
+    seen = set()
+    pending = []
+    for rel_path, size, mtime in scan(root):
+        seen.add(rel_path)
+        entry = manifest.get(rel_path)
+        if entry is None or entry['size'] != size or entry['mtime'] != mtime:
+            pending.append(rel_path)
+
+    # Files deleted since the last run
+    for rel_path in set(manifest) - seen:
+        del manifest[rel_path]
+
+    counts = defaultdict(int)
+    counts['unchanged'] = len(seen) - len(pending)
+    if pending:
+        paths = [os.path.join(root, p) for p in pending]
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(check_file, paths, [convert] * len(paths), [remove_corrupt] * len(paths),
+                               chunksize=32)
+            for original, record in zip(pending, results):
+                counts[record['status']] += 1
+                manifest.pop(original, None)
+                if record['status'] in ('corrupt', 'removed'):
+                    print(f"Bad image: {record['path']} - {record['error']}")
+                    if record['status'] == 'corrupt':
+                        manifest[original] = {'status': 'corrupt', 'size': None, 'mtime': None}
+                    continue
+                rel_path = os.path.relpath(record['path'], root)
+                stat = os.stat(record['path'])
+                manifest[rel_path] = {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'sha256': record['sha256'],
+                    'dhash': record['dhash'],
+                    'width': record['width'],
+                    'height': record['height'],
+                    'status': 'ok'
+                }
+
+    save_manifest(root, manifest)
+    return manifest, counts
+
+
+def _label(rel_path):
+    """(split, class) for paths like train/dog_ringworm/x.jpg or dog_ringworm/x.jpg"""
+    parts = rel_path.replace('\\', '/').split('/')
+    if len(parts) >= 3:
+        return parts[-3], parts[-2]
+    return None, parts[-2] if len(parts) == 2 else None
+
+
+def find_duplicates(manifest, max_distance=4):
+    """Exact (same SHA-256) and near (dHash within max_distance bits) duplicate pairs"""
+    entries = [(p, e) for p, e in manifest.items() if e.get('status') == 'ok']
+
+    exact = defaultdict(list)
+    for path, entry in entries:
+        exact[entry['sha256']].append(path)
+    exact_groups = [sorted(paths) for paths in exact.values() if len(paths) > 1]
+
+    # Split the 64-bit hash into bands; pairs within a few bits share at
+    # least one band, so only bucket-mates need a full comparison
+    bands = max_distance + 1
+    band_bits = 64 // bands
+    buckets = defaultdict(list)
+    for path, entry in entries:
+        for band in range(bands):
+            key = (entry['dhash'] >> (band * band_bits)) & ((1 << band_bits) - 1)
+            buckets[(band, key)].append((path, entry))
+
+    near = set()
+    for bucket in buckets.values():
+        for i in range(len(bucket)):
+            for j in range(i + 1, len(bucket)):
+                (a, ea), (b, eb) = bucket[i], bucket[j]
+                if ea['sha256'] == eb['sha256']:
+                    continue
+                if bin(ea['dhash'] ^ eb['dhash']).count('1') <= max_distance:
+                    near.add(tuple(sorted((a, b))))
+
+    def describe(paths):
+        labels = [_label(p) for p in paths]
+        return {
+            'paths': list(paths),
+            'cross_class': len({c for _, c in labels}) > 1,
+            'cross_split': len({s for s, _ in labels}) > 1
+        }
+
+    return {
+        'exact': [describe(g) for g in exact_groups],
+        'near': [describe(pair) for pair in sorted(near)]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check, convert and de-duplicate an image dataset, touching only new or changed files'
+    )
+    parser.add_argument('root', nargs='?', default=os.path.join('datasets', 'dog'),
+                        help='Dataset root; point it at data to also compare train against valid')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--no-convert', action='store_true', help='Leave non-JPEG images as they are')
+    parser.add_argument('--keep-corrupt', action='store_true', help='Report corrupt files without deleting them')
+    parser.add_argument('--max-distance', type=int, default=4,
+                        help='Max dHash bit difference for near-duplicates')
+    parser.add_argument('--report', default=None, help='Write the duplicate report to this JSON file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    manifest, counts = update_manifest(args.root, args.workers, not args.no_convert, not args.keep_corrupt)
+    duplicates = find_duplicates(manifest, args.max_distance)
+    elapsed = time.perf_counter() - start
+
+    print(f"Scanned {len(manifest)} files in {args.root} in {elapsed:.1f}s: "
+          + ', '.join(f"{k} {v}" for k, v in sorted(counts.items())))
+    for kind in ('exact', 'near'):
+        groups = duplicates[kind]
+        cross_class = sum(g['cross_class'] for g in groups)
+        cross_split = sum(g['cross_split'] for g in groups)
+        print(f"{kind.capitalize()} duplicates: {len(groups)} "
+              f"({cross_class} across classes, {cross_split} across train/valid)")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(duplicates, f, indent=2)
+        print(f"Duplicate report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
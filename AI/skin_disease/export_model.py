@@ -0,0 +1,240 @@
+import argparse
+import inspect
+import json
+import os
+import tempfile
+import time
+
+import torch
+from torch.utils.data import DataLoader
+from torchvision import datasets
+
+from predict import SkinDiseaseClassifier
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux), 0 when unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def load_fp32_model(checkpoint_path):
+    classifier = SkinDiseaseClassifier(checkpoint_path, backend='eager')
+    model = classifier.model.cpu().eval()
+    return model, classifier.class_names, classifier.transform, classifier.arch
+
+
+def image_loader(data_dir, transform, batch_size, shuffle=False):
+    dataset = datasets.ImageFolder(data_dir, transform)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, num_workers=2), dataset.classes
+
+
+def quantize_dynamic(model):
+    """int8 weights for Linear layers; activations stay float.
+
+    For ResNet-50 this only touches the fc head, so the gain is small;
+    static quantization is what covers the convolutions.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_dir, transform, num_batches=10, batch_size=16):
+    """Post-training static int8 quantization (FX graph mode) calibrated on real images"""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    example = torch.randn(1, 3, 224, 224)
+    prepared = prepare_fx(model, get_default_qconfig_mapping('x86'), (example,))
+
+    loader, _ = image_loader(calibration_dir, transform, batch_size, shuffle=True)
+    with torch.no_grad():
+        for i, (inputs, _) in enumerate(loader):
+            if i >= num_batches:
+                break
+            prepared(inputs)
+
+    return convert_fx(prepared)
+
+
+def export_slim(model, class_names, path, arch='resnet50'):
+    """Inference-only eager checkpoint: fp32 weights and class names, no optimizer state"""
+    torch.save({'model_state_dict': model.state_dict(), 'class_names': class_names, 'arch': arch}, path)
+    print(f"Saved slim checkpoint to {path}")
+
+
+def export_torchscript(model, class_names, path):
+    example = torch.randn(1, 3, 224, 224)
+    with torch.no_grad():
+        scripted = torch.jit.freeze(torch.jit.trace(model.eval(), example))
+    torch.jit.save(scripted, path, _extra_files={'class_names.json': json.dumps(class_names)})
+    print(f"Saved TorchScript model to {path}")
+
+
+def export_onnx(model, class_names, path, quantize=False):
+    import onnx
+
+    example = torch.randn(1, 3, 224, 224)
+    # Stick to the TorchScript-based exporter where torch offers a choice; its
+    # graphs pass onnxruntime's quantizer shape checks
+    export_kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs['dynamo'] = False
+
+    # Export into a scratch directory: some exporters write weights to a side
+    # file, which onnx.load folds back in before the final save
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fp32_path = os.path.join(tmp_dir, 'model.onnx')
+        torch.onnx.export(
+            model.eval(), example, fp32_path,
+            input_names=['input'], output_names=['logits'],
+            dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=17, **export_kwargs
+        )
+        onnx_model = onnx.load(fp32_path)
+
+        if quantize:
+            from onnxruntime.quantization import QuantType
+            from onnxruntime.quantization import quantize_dynamic as ort_quantize_dynamic
+            inline_path = os.path.join(tmp_dir, 'inline.onnx')
+            int8_path = os.path.join(tmp_dir, 'int8.onnx')
+            onnx.save(onnx_model, inline_path)
+            ort_quantize_dynamic(inline_path, int8_path, weight_type=QuantType.QInt8)
+            onnx_model = onnx.load(int8_path)
+
+    # Keep class names inside the artifact so it can be served on its own
+    meta = onnx_model.metadata_props.add()
+    meta.key = 'class_names'
+    meta.value = json.dumps(class_names)
+    onnx.save(onnx_model, path)
+    print(f"Saved ONNX model to {path}")
+
+
+def evaluate(classifier, valid_dir, batch_size=32):
+    """Species-filtered top-1 accuracy and throughput on an ImageFolder split"""
+    loader, folder_classes = image_loader(valid_dir, classifier.transform, batch_size)
+    species_of = [c.split('_', 1)[0] for c in folder_classes]
+
+    predictions, labels = [], []
+    forward_time = 0.0
+    for inputs, targets in loader:
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = classifier.model(inputs.to(classifier.device)).cpu()
+        forward_time += time.perf_counter() - start
+
+        results = classifier.postprocess(outputs, [species_of[t] for t in targets.tolist()])
+        predictions.extend(r.get('full_prediction') for r in results)
+        labels.extend(folder_classes[t] for t in targets.tolist())
+
+    correct = sum(p == l for p, l in zip(predictions, labels))
+    return {
+        'images': len(labels),
+        'accuracy': correct / len(labels) if labels else 0.0,
+        'ms_per_image': 1000 * forward_time / len(labels) if labels else 0.0,
+        'images_per_sec': len(labels) / forward_time if forward_time else 0.0,
+        'predictions': predictions
+    }
+
+
+def accuracy_report(checkpoint_path, artifacts, valid_dir, batch_size, report_path):
+    """Compare every exported artifact against the eager FP32 checkpoint"""
+    rows = []
+    baseline = None
+    for backend, path in [('eager', checkpoint_path)] + artifacts:
+        rss_before = current_rss_mb()
+        start = time.perf_counter()
+        classifier = SkinDiseaseClassifier(path, backend=backend)
+        load_time = time.perf_counter() - start
+        rss_loaded = current_rss_mb() - rss_before
+
+        metrics = evaluate(classifier, valid_dir, batch_size)
+        predictions = metrics.pop('predictions')
+        if baseline is None:
+            baseline = metrics['accuracy'], predictions
+
+        agreement = sum(p == b for p, b in zip(predictions, baseline[1])) / max(len(predictions), 1)
+        rows.append({
+            'artifact': os.path.basename(path),
+            'backend': backend,
+            'size_mb': os.path.getsize(path) / (1024 * 1024),
+            'load_time_s': load_time,
+            'rss_after_load_mb': rss_loaded,
+            'accuracy_delta': metrics['accuracy'] - baseline[0],
+            'agreement_with_fp32': agreement,
+            **metrics
+        })
+        del classifier
+
+    with open(report_path, 'w') as f:
+        json.dump(rows, f, indent=2)
+
+    print(f"\n{'artifact':<32}{'size MB':>9}{'acc':>8}{'delta':>8}{'agree':>8}{'ms/img':>9}{'RSS MB':>9}")
+    for row in rows:
+        print(f"{row['artifact']:<32}{row['size_mb']:>9.1f}{row['accuracy']:>8.3f}"
+              f"{row['accuracy_delta']:>+8.3f}{row['agreement_with_fp32']:>8.3f}"
+              f"{row['ms_per_image']:>9.2f}{row['rss_after_load_mb']:>9.1f}")
+    print(f"\nReport written to {report_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export best_model.pth to optimized inference artifacts')
+    parser.add_argument('--checkpoint', default='best_model.pth')
+    parser.add_argument('--output-dir', default='exported')
+    parser.add_argument('--format', nargs='+', choices=['slim', 'torchscript', 'onnx'], default=['torchscript'],
+                        help='slim writes model.slim.pt, the memory-mapped eager format')
+    parser.add_argument('--quantize', choices=['none', 'dynamic', 'static'], default='none',
+                        help='Also export an int8 variant (static is TorchScript only)')
+    parser.add_argument('--calibration-dir', default=os.path.join('data', 'train'))
+    parser.add_argument('--valid-dir', default=os.path.join('data', 'valid'))
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--no-report', action='store_true', help='Skip the accuracy-delta report')
+    args = parser.parse_args()
+
+    # Quantized kernels and the ONNX exporter both expect a CPU model
+    torch.backends.quantized.engine = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'fbgemm'
+    os.makedirs(args.output_dir, exist_ok=True)
+    model, class_names, transform, arch = load_fp32_model(args.checkpoint)
+    artifacts = []
+
+    if 'slim' in args.format:
+        path = os.path.join(args.output_dir, 'model.slim.pt')
+        export_slim(model, class_names, path, arch)
+        artifacts.append(('eager', path))
+
+    if 'torchscript' in args.format:
+        path = os.path.join(args.output_dir, 'model.ts.pt')
+        export_torchscript(model, class_names, path)
+        artifacts.append(('torchscript', path))
+
+        if args.quantize == 'dynamic':
+            path = os.path.join(args.output_dir, 'model_int8_dynamic.ts.pt')
+            export_torchscript(quantize_dynamic(model), class_names, path)
+            artifacts.append(('torchscript', path))
+        elif args.quantize == 'static':
+            print(f"Calibrating static quantization on {args.calibration_dir}...")
+            quantized = quantize_static(load_fp32_model(args.checkpoint)[0], args.calibration_dir, transform)
+            path = os.path.join(args.output_dir, 'model_int8_static.ts.pt')
+            export_torchscript(quantized, class_names, path)
+            artifacts.append(('torchscript', path))
+
+    if 'onnx' in args.format:
+        path = os.path.join(args.output_dir, 'model.onnx')
+        export_onnx(model, class_names, path)
+        artifacts.append(('onnx', path))
+
+        if args.quantize == 'dynamic':
+            path = os.path.join(args.output_dir, 'model_int8_dynamic.onnx')
+            export_onnx(model, class_names, path, quantize=True)
+            artifacts.append(('onnx', path))
+
+    if not args.no_report:
+        accuracy_report(args.checkpoint, artifacts, args.valid_dir, args.batch_size,
+                        os.path.join(args.output_dir, 'report.json'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Production serving for the skin disease API:
+#
+#     gunicorn -c gunicorn.conf.py app:app
+#
+# The app (and the model weights) are loaded once in the master and shared
+# copy-on-write with the forked workers. Each worker caps its intra-op
+# threads and runs a warm-up inference before it starts accepting requests.
+import gc
+import glob
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('BIND', '0.0.0.0:5006')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Threads let the micro-batcher group concurrent requests inside one worker;
+# two more than MAX_PENDING_REQUESTS leaves room for /health and /metrics
+worker_class = 'gthread'
+threads = int(os.environ.get('WORKER_THREADS', 10))
+timeout = int(os.environ.get('WORKER_TIMEOUT', 60))
+preload_app = True
+
+# Split the cores between workers so they don't oversubscribe the CPU
+torch_threads = int(os.environ.get('TORCH_THREADS', max(1, multiprocessing.cpu_count() // workers)))
+
+# Must be set before torch is imported by the preloaded app
+os.environ.setdefault('OMP_NUM_THREADS', str(torch_threads))
+os.environ.setdefault('MKL_NUM_THREADS', str(torch_threads))
+
+# Workers write their metrics to files here so /metrics can sum them; must be
+# set before prometheus_client is imported. Stale files from the previous run
+# would double-count, so they are removed on startup.
+metrics_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'skin_disease_metrics')
+)
+os.makedirs(metrics_dir, exist_ok=True)
+for stale in glob.glob(os.path.join(metrics_dir, '*.db')):
+    os.remove(stale)
+
+
+def when_ready(server):
+    # Move the loaded model's Python objects out of the GC's reach so
+    # collections in the workers don't touch (and copy) the shared pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import torch
+    import app
+
+    torch.set_num_threads(torch_threads)
+    app.warm_up()
+    # Each worker watches the model file (MODEL_WATCH_INTERVAL) and the
+    # trigger file that /admin/reload touches, so every worker reloads
+    app.reloader.start_watching()
+    server.log.info(f"Worker {worker.pid} warmed up with {torch_threads} torch threads")
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
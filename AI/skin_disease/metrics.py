@@ -0,0 +1,28 @@
+from prometheus_client import Counter, Gauge, Histogram
+from observability import LATENCY_BUCKETS, instrument
+
+# Stages of /predict: upload_read, decode, transform, queue_wait, forward, postprocess
+STAGE_SECONDS = Histogram('skin_stage_seconds', 'Time spent in each prediction stage', ['stage'],
+                          buckets=(0.001, 0.0025,) + LATENCY_BUCKETS)
+CACHE_LOOKUPS = Counter('skin_cache_lookups_total', 'Prediction cache lookups', ['result'])
+QUEUE_DEPTH = Gauge('skin_batch_queue_depth', 'Preprocessed images waiting for the batch worker',
+                    multiprocess_mode='livesum')
+BATCH_SIZE = Histogram('skin_batch_size', 'Images scored per forward pass', buckets=(1, 2, 4, 8, 16, 32, 64))
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_batch(size, queue_depth):
+    BATCH_SIZE.observe(size)
+    QUEUE_DEPTH.set(queue_depth)
+
+
+def set_queue_depth(queue_depth):
+    QUEUE_DEPTH.set(queue_depth)
+
+
+def observe_cache(hit):
+    CACHE_LOOKUPS.labels('hit' if hit else 'miss').inc()
+
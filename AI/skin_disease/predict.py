@@ -2,81 +2,388 @@ import torch
 from torchvision import transforms, models
 from PIL import Image
 import numpy as np
+import hashlib
+import io
+import json
 import os
+import pickle
+import sys
+import threading
+
+# Image loading shared with the license verifier lives in AI/common
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from imaging import load_pil
+
+BACKENDS = ('eager', 'torchscript', 'onnx')
+# Short side the transform resizes to; JPEGs are decoded no smaller than this
+RESIZE_TO = 256
+
+# Networks an eager checkpoint may hold, named by its 'arch' entry; the small
+# ones are distilled cascade students (train_model.py --distill-from)
+ARCHITECTURES = {
+    'resnet50': (models.resnet50, 'ResNet50_Weights.DEFAULT'),
+    'mobilenet_v3_large': (models.mobilenet_v3_large, 'MobileNet_V3_Large_Weights.DEFAULT'),
+    'mobilenet_v3_small': (models.mobilenet_v3_small, 'MobileNet_V3_Small_Weights.DEFAULT'),
+    'efficientnet_b0': (models.efficientnet_b0, 'EfficientNet_B0_Weights.DEFAULT'),
+}
+
+
+def build_network(arch, num_classes, pretrained=False):
+    """Torchvision network with its final layer resized to ``num_classes``"""
+    if arch not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture: {arch}. Must be one of {tuple(ARCHITECTURES)}")
+    constructor, weights = ARCHITECTURES[arch]
+    model = constructor(weights=weights if pretrained else None)
+    if arch == 'resnet50':
+        model.fc = torch.nn.Linear(model.fc.in_features, num_classes)
+    else:
+        model.classifier[-1] = torch.nn.Linear(model.classifier[-1].in_features, num_classes)
+    return model
+
+
+def split_network(model, arch):
+    """(trunk, head) sharing ``model``'s modules; trunk outputs the penultimate features.
+
+    ``head(trunk(x))`` computes the same logits as ``model(x)``; for ResNet-50
+    the trunk output is the pooled 2048-d embedding.
+    """
+    if arch == 'resnet50':
+        trunk = torch.nn.Sequential(*list(model.children())[:-1], torch.nn.Flatten())
+        return trunk, model.fc
+    trunk = torch.nn.Sequential(model.features, model.avgpool, torch.nn.Flatten(), *model.classifier[:-1])
+    return trunk, model.classifier[-1]
+
+
+def detect_backend(model_path):
+    """Infer the inference backend from an artifact's file name"""
+    if model_path.endswith('.onnx'):
+        return 'onnx'
+    if model_path.endswith('.ts.pt'):
+        return 'torchscript'
+    return 'eager'
+
+
+class OnnxModel:
+    """Callable wrapper so an ONNX Runtime session can stand in for the torch model"""
 
-class SkinDiseaseClassifier:
     def __init__(self, model_path):
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime (pip install onnxruntime)")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.class_names = json.loads(metadata['class_names'])
+
+    def __call__(self, batch):
+        outputs = self.session.run(None, {self.input_name: batch.numpy()})[0]
+        return torch.from_numpy(outputs)
+
+
+class SkinDiseaseClassifier:
+    """Species-filtered skin condition classifier.
+
+    With ``student_path`` set it runs as a cascade: the small distilled
+    student scores every image first, and only images whose species-filtered
+    confidence is below ``cascade_threshold`` are re-scored by the full
+    model. ``cascade_report.py`` picks the threshold on the validation set.
+
+    Eager checkpoints can also return each image's penultimate-layer
+    embedding (``embeddings=True``) for similar-case search. Embeddings
+    always come from the full model, so those requests skip the cascade.
+    """
+
+    def __init__(self, model_path, backend='auto', student_path=None, cascade_threshold=0.9, mmap=True):
+        if backend == 'auto':
+            backend = detect_backend(model_path)
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend: {backend}. Must be one of {BACKENDS}")
+        self.backend = backend
+        self.arch = None
+        self.trunk = self.head = None
+        self.mmap = mmap
+        self.model_version = None
+        # Exported artifacts (possibly int8) are built for our CPU nodes
+        if backend == 'eager' and torch.cuda.is_available():
+            self.device = torch.device("cuda")
+        else:
+            self.device = torch.device("cpu")
         self.model, self.class_names = self._load_model(model_path)
+        self.model_version = self.model_version or self._artifact_version(model_path)
+        self._build_species_tables()
         self.transform = self._get_transform()
-        
+        # Embeddings are only comparable between identical full models
+        self.embedding_version = self.model_version if self.trunk is not None else None
+        self.embedding_dim = self.head.in_features if self.head is not None else None
+
+        self.student = None
+        self.cascade_threshold = cascade_threshold
+        self._cascade_lock = threading.Lock()
+        self._cascade_counts = {'images': 0, 'escalated': 0}
+        if student_path:
+            self.student = SkinDiseaseClassifier(student_path, mmap=mmap)
+            if self.student.class_names != self.class_names:
+                raise ValueError(f"{student_path} was trained on different classes than {model_path}")
+            # Cached predictions depend on the student and the threshold too
+            key = f"{self.model_version}:{self.student.model_version}:{cascade_threshold}"
+            self.model_version = hashlib.sha256(key.encode()).hexdigest()[:16]
+
     def _load_model(self, model_path):
-        checkpoint = torch.load(model_path, map_location=self.device)
+        if self.backend == 'torchscript':
+            extra_files = {'class_names.json': ''}
+            model = torch.jit.load(model_path, map_location=self.device, _extra_files=extra_files)
+            model.eval()
+            return model, json.loads(extra_files['class_names.json'])
+        if self.backend == 'onnx':
+            model = OnnxModel(model_path)
+            return model, model.class_names
+
+        checkpoint = self._load_checkpoint(model_path)
         class_names = checkpoint['class_names']
+        # Checkpoints from before distillation support are all ResNet-50
+        self.arch = checkpoint.get('arch', 'resnet50')
         
-        model = models.resnet50(weights=None)
-        num_ftrs = model.fc.in_features
-        model.fc = torch.nn.Linear(num_ftrs, len(class_names))
-        model.load_state_dict(checkpoint['model_state_dict'])
+        # Built on the meta device and given the checkpoint tensors directly,
+        # so no memory is spent on random init or on a second copy of the weights
+        with torch.device('meta'):
+            model = build_network(self.arch, len(class_names))
+        model.load_state_dict(checkpoint['model_state_dict'], assign=True)
         model = model.to(self.device)
         model.eval()
+        self.trunk, self.head = split_network(model, self.arch)
         
         return model, class_names
+
+    def _load_checkpoint(self, model_path):
+        """Memory-map a checkpoint, falling back to a full read for old formats.
+
+        Mapped tensors are paged in from the file on first use and the pages
+        are shared by every process that maps the same file; entries the
+        model never touches (e.g. the optimizer state in best_model.pth) are
+        not read at all.
+
+        A mapped file must only ever be replaced by a rename, never rewritten
+        in place (e.g. ``cp``), or the loaded weights change underneath the
+        model. With ``mmap=False`` the file is read once into private memory
+        instead, and the version hashes exactly the bytes that were loaded.
+
+        Training checkpoints also hold plain Python and numpy objects (RNG
+        and sampler state) that ``weights_only`` refuses; those are loaded
+        with the full unpickler instead.
+        """
+        if not self.mmap:
+            with open(model_path, 'rb') as f:
+                data = f.read()
+            self.model_version = hashlib.sha256(data).hexdigest()[:16]
+            try:
+                return torch.load(io.BytesIO(data), map_location='cpu', weights_only=True)
+            except pickle.UnpicklingError:
+                return torch.load(io.BytesIO(data), map_location='cpu', weights_only=False)
+        try:
+            return torch.load(model_path, map_location='cpu', mmap=True, weights_only=True)
+        except pickle.UnpicklingError:
+            return torch.load(model_path, map_location='cpu', mmap=True, weights_only=False)
+        except RuntimeError:
+            # Legacy (non-zip) checkpoints can't be mapped
+            return torch.load(model_path, map_location='cpu', weights_only=False)
     
+    def _artifact_version(self, model_path, chunk_size=1024 * 1024):
+        """Content hash of the loaded artifact, used to key cached predictions"""
+        digest = hashlib.sha256()
+        with open(model_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()[:16]
+
+    def _build_species_tables(self):
+        """Precompute per-species class lookups once per checkpoint"""
+        # Class folders are named "<species>_<condition>", e.g. "dog_ringworm"
+        species_names = sorted({c.split('_', 1)[0] for c in self.class_names if '_' in c})
+        self.species_ids = {species: i for i, species in enumerate(species_names)}
+        self.species_indices = {
+            species: [i for i, c in enumerate(self.class_names) if c.startswith(species + '_')]
+            for species in species_names
+        }
+        self.display_names = [c.split('_', 1)[1] if '_' in c else c for c in self.class_names]
+
+        # Row s is True for the classes belonging to species s
+        self.species_mask = torch.zeros(len(species_names), len(self.class_names), dtype=torch.bool)
+        for species, indices in self.species_indices.items():
+            self.species_mask[self.species_ids[species], indices] = True
+
     def _get_transform(self):
         return transforms.Compose([
-            transforms.Resize(256),
+            transforms.Resize(RESIZE_TO),
             transforms.CenterCrop(224),
             transforms.ToTensor(),
             transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
         ])
     
-    def predict(self, image_path, species):
-        """Predict skin condition for specific species"""
-        try:
-            # Filter classes for the specified species
-            species_classes = [c for c in self.class_names if c.startswith(species + '_')]
-            if not species_classes:
-                raise ValueError(f"No classes found for species: {species}")
-            
-            # Get indices of species-specific classes
-            class_indices = [self.class_names.index(c) for c in species_classes]
-            
-            # Process image
-            image = Image.open(image_path).convert('RGB')
-            image = self.transform(image).unsqueeze(0).to(self.device)
-            
-            with torch.no_grad():
-                outputs = self.model(image)
-                probs = torch.nn.functional.softmax(outputs, dim=1)
-                
-                # Get probabilities only for the specified species
-                species_probs = probs[0][class_indices]
-                conf, pred_idx = torch.max(species_probs, 0)
-                
-                # Get the full class name and base condition
-                full_pred = species_classes[pred_idx]
-                base_condition = full_pred.replace(f"{species}_", "")
-                
-                # Get all probabilities for the species
-                prob_dict = {
-                    c.replace(f"{species}_", ""): float(p)
-                    for c, p in zip(species_classes, species_probs)
-                }
-            
-            return {
+    def load_image(self, image):
+        """Decode a path, raw bytes, file-like object, array or PIL image to RGB"""
+        if isinstance(image, Image.Image):
+            return image.convert('RGB')
+        if isinstance(image, np.ndarray):
+            # Decoded arrays are expected as HxWxC uint8 RGB (or HxW grayscale)
+            return Image.fromarray(image).convert('RGB')
+        # Reduced-size JPEG decode plus EXIF rotation, same as the license verifier
+        return load_pil(image, min_size=RESIZE_TO)
+
+    def preprocess(self, image):
+        """Load an image and return its normalized (3, 224, 224) tensor"""
+        return self.transform(self.load_image(image))
+
+    def postprocess(self, outputs, species_list):
+        """Turn a batch of logits into species-filtered result dicts.
+
+        Probabilities keep the full-softmax scale the service has always
+        reported; the species mask only restricts which classes can win.
+        """
+        results = [None] * len(species_list)
+        rows, known = [], []
+        for i, species in enumerate(species_list):
+            if species in self.species_ids:
+                rows.append(self.species_ids[species])
+                known.append(i)
+            else:
+                results[i] = {'error': f"No classes found for species: {species}"}
+
+        if not known:
+            return results
+
+        probs = torch.nn.functional.softmax(outputs[known].float(), dim=1)
+        mask = self.species_mask[rows]
+        conf, pred_idx = probs.masked_fill(~mask, -1.0).max(dim=1)
+
+        probs, conf, pred_idx = probs.tolist(), conf.tolist(), pred_idx.tolist()
+        for j, i in enumerate(known):
+            species = species_list[i]
+            results[i] = {
                 'species': species,
-                'prediction': base_condition,
-                'full_prediction': full_pred,
-                'confidence': float(conf),
-                'class_probabilities': prob_dict
+                'prediction': self.display_names[pred_idx[j]],
+                'full_prediction': self.class_names[pred_idx[j]],
+                'confidence': conf[j],
+                'class_probabilities': {
+                    self.display_names[k]: probs[j][k] for k in self.species_indices[species]
+                }
             }
-            
+        return results
+
+    def species_confidence(self, outputs, species_list):
+        """Winning species-filtered probability per row, as reported by ``postprocess``"""
+        mask = torch.ones(len(species_list), len(self.class_names), dtype=torch.bool)
+        for i, species in enumerate(species_list):
+            if species in self.species_ids:
+                mask[i] = self.species_mask[self.species_ids[species]]
+        probs = torch.nn.functional.softmax(outputs.float(), dim=1)
+        return probs.masked_fill(~mask, -1.0).max(dim=1).values
+
+    def _run_model(self, tensors):
+        batch = torch.stack(tensors).to(self.device)
+
+        with torch.no_grad():
+            return self.model(batch).cpu()
+
+    def _run_with_embeddings(self, tensors):
+        if self.trunk is None:
+            raise ValueError(f"Embeddings need an eager checkpoint, not the {self.backend} backend")
+        batch = torch.stack(tensors).to(self.device)
+
+        with torch.no_grad():
+            features = self.trunk(batch)
+            return self.head(features).cpu(), features.cpu()
+
+    def forward(self, tensors, species_list=None, embeddings=False):
+        """Run preprocessed image tensors through the model as one batch; returns CPU logits.
+
+        In cascade mode, and when ``species_list`` is given, rows the student
+        is confident about keep the student's logits and the rest are
+        replaced by the full model's. Without a species list the full model
+        scores everything. With ``embeddings`` the full model scores
+        everything and ``(logits, embeddings)`` is returned.
+        """
+        if embeddings:
+            return self._run_with_embeddings(tensors)
+        if self.student is None or species_list is None:
+            return self._run_model(tensors)
+
+        outputs = self.student.forward(tensors).float()
+        confidence = self.species_confidence(outputs, species_list)
+        escalate = (confidence < self.cascade_threshold).nonzero().flatten().tolist()
+        if escalate:
+            outputs[escalate] = self._run_model([tensors[i] for i in escalate]).float()
+        with self._cascade_lock:
+            self._cascade_counts['images'] += len(tensors)
+            self._cascade_counts['escalated'] += len(escalate)
+        return outputs
+
+    def cascade_stats(self):
+        with self._cascade_lock:
+            counts = dict(self._cascade_counts)
+        return dict(
+            counts,
+            enabled=self.student is not None,
+            threshold=self.cascade_threshold if self.student is not None else None,
+            escalation_rate=counts['escalated'] / counts['images'] if counts['images'] else 0.0
+        )
+
+    def attach_embeddings(self, results, embeddings):
+        """Add each successful result's float32 embedding as ``result['embedding']``"""
+        for result, embedding in zip(results, embeddings.float().numpy()):
+            if 'error' not in result:
+                result['embedding'] = embedding
+        return results
+
+    def predict_tensors(self, tensors, species_list, embeddings=False):
+        """Score preprocessed image tensors in a single forward pass.
+
+        Returns one result dict per input, in order; a failure for one
+        species does not affect the other results in the batch.
+        """
+        if embeddings:
+            outputs, features = self.forward(tensors, species_list, embeddings=True)
+            return self.attach_embeddings(self.postprocess(outputs, species_list), features)
+        return self.postprocess(self.forward(tensors, species_list), species_list)
+
+    def predict_batch(self, images, species_list):
+        """Predict skin conditions for several images in one forward pass.
+
+        ``images`` may mix paths, bytes, file-like objects and decoded arrays.
+        Images that fail to decode get an error result without failing the
+        rest of the batch.
+        """
+        if len(images) != len(species_list):
+            raise ValueError("images and species_list must have the same length")
+
+        results = [None] * len(images)
+        tensors, species_ok, positions = [], [], []
+        for i, (image, species) in enumerate(zip(images, species_list)):
+            try:
+                tensors.append(self.preprocess(image))
+                species_ok.append(species)
+                positions.append(i)
+            except Exception as e:
+                results[i] = {'error': str(e)}
+
+        if tensors:
+            for i, result in zip(positions, self.predict_tensors(tensors, species_ok)):
+                results[i] = result
+        return results
+
+    def predict(self, image, species):
+        """Predict skin condition for specific species"""
+        try:
+            tensor = self.preprocess(image)
+            return self.predict_tensors([tensor], [species])[0]
+
         except Exception as e:
             return {'error': str(e)}
 
 if __name__ == '__main__':
-    # Example usage
+    # Example usage; to score a whole directory or manifest use score_images.py
     classifier = SkinDiseaseClassifier('best_model.pth')
     
     # Test prediction for dog
@@ -86,3 +393,7 @@ if __name__ == '__main__':
     # Test prediction for cat
     cat_result = classifier.predict('test_cat.jpg', 'cat')
     print("Cat Prediction:", cat_result)
+
+    # Score several images in one forward pass
+    batch_results = classifier.predict_batch(['test_dog.jpg', 'test_cat.jpg'], ['dog', 'cat'])
+    print("Batch Predictions:", batch_results)
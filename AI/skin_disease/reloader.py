@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import time
+
+from predict import SkinDiseaseClassifier
+
+logger = logging.getLogger(__name__)
+
+
+class ModelReloader:
+    """Swaps in a new model without stopping the service.
+
+    ``reload()`` builds a classifier from ``model_path`` on a background
+    thread, warms it up and only then hands it to ``on_swap``. Until that
+    moment every request keeps using the old model, and requests already
+    running finish on the model they started with. A failed build leaves
+    the old model in place.
+
+    ``start_watching()`` polls the file and reloads when it changes, so a
+    deploy only has to replace the file (ideally with an atomic rename).
+
+    Every gunicorn worker holds its own model, so ``request_reload()``
+    touches ``trigger_path`` instead of reloading directly; each worker's
+    watcher polls it and reloads, whichever worker served the request.
+    """
+
+    def __init__(self, model_path, backend='auto', warm_up=None, on_swap=None, poll_interval=0, options=None,
+                 trigger_path=None, trigger_interval=1.0):
+        self.model_path = model_path
+        self.backend = backend
+        # Extra SkinDiseaseClassifier arguments, e.g. the cascade student
+        self.options = options or {}
+        self.warm_up = warm_up
+        self.on_swap = on_swap
+        self.poll_interval = poll_interval
+        self.trigger_path = trigger_path
+        self.trigger_interval = trigger_interval
+        self.state = 'idle'
+        self.last_error = None
+        self.last_reload = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._watcher = None
+        self._pid = None
+        self._signature = self._file_signature()
+        self._trigger = self._file_signature(trigger_path)
+
+    def _file_signature(self, path=None):
+        # The inode changes when a deploy renames a new file into place
+        try:
+            stat = os.stat(path or self.model_path)
+            return stat.st_ino, stat.st_mtime_ns, stat.st_size
+        except (OSError, TypeError):
+            return None
+
+    def reload(self):
+        """Start a background reload; returns False if one is already running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self.state = 'loading'
+            self._thread = threading.Thread(target=self._build, name='model-reload', daemon=True)
+            self._thread.start()
+            return True
+
+    def request_reload(self):
+        """Reload every process watching ``trigger_path``, or only this one without it"""
+        if self.trigger_path is None:
+            return self.reload()
+        if self.state == 'loading':
+            return False
+        with open(self.trigger_path, 'a'):
+            pass
+        os.utime(self.trigger_path)
+        return True
+
+    def _build(self):
+        start = time.perf_counter()
+        # Recorded even if the build fails, so the watcher waits for the next
+        # change instead of retrying a broken file forever
+        self._signature = self._file_signature()
+        try:
+            classifier = SkinDiseaseClassifier(self.model_path, backend=self.backend, **self.options)
+            if self.warm_up is not None:
+                self.warm_up(classifier)
+            self.on_swap(classifier)
+            self.state = 'idle'
+            self.last_error = None
+            self.last_reload = time.time()
+            logger.info(f"Loaded model {classifier.model_version} in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            self.state = 'failed'
+            self.last_error = str(e)
+            logger.error(f"Model reload failed, keeping the current model: {e}", exc_info=True)
+
+    def _watch(self):
+        interval = self.poll_interval if self.poll_interval > 0 else self.trigger_interval
+        if self.trigger_path is not None:
+            interval = min(interval, self.trigger_interval)
+        last_poll = time.monotonic()
+        while True:
+            time.sleep(interval)
+            if self.trigger_path is not None:
+                trigger = self._file_signature(self.trigger_path)
+                # Only consumed once a reload actually starts, so a busy worker retries
+                if trigger is not None and trigger != self._trigger and self.reload():
+                    logger.info("Reload requested through the trigger file")
+                    self._trigger = trigger
+            if self.poll_interval <= 0 or time.monotonic() - last_poll < self.poll_interval:
+                continue
+            last_poll = time.monotonic()
+            signature = self._file_signature()
+            if signature is None or signature == self._signature:
+                continue
+            # Wait for a copy in progress to settle before loading
+            time.sleep(self.poll_interval)
+            if self._file_signature() == signature:
+                logger.info(f"{self.model_path} changed; reloading")
+                self.reload()
+
+    def start_watching(self):
+        """Poll the model file every ``poll_interval`` seconds and the trigger file, if any"""
+        if self.poll_interval <= 0 and self.trigger_path is None:
+            return
+        # Threads don't survive fork, so each gunicorn worker starts its own
+        if self._watcher is not None and self._watcher.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._watcher = threading.Thread(target=self._watch, name='model-watch', daemon=True)
+        self._watcher.start()
+
+    def status(self):
+        return {
+            'state': self.state,
+            'model_path': self.model_path,
+            'last_error': self.last_error,
+            'last_reload': self.last_reload,
+            'watch_interval': self.poll_interval,
+            'trigger_path': self.trigger_path
+        }
@@ -0,0 +1,329 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import time
+
+from torch.utils.data import DataLoader, Dataset
+
+from predict import RESIZE_TO, SkinDiseaseClassifier, load_pil
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def infer_species(rel_path, species_names, default=None):
+    """Species from a path component such as ``dog/...`` or ``dog_ringworm/...``"""
+    for part in rel_path.replace(os.sep, '/').split('/')[:-1]:
+        for species in species_names:
+            if part == species or part.startswith(species + '_'):
+                return species
+    return default
+
+
+def list_directory(root, species_names, default_species=None):
+    items = []
+    for dirpath, _, files in os.walk(root):
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, name)
+            rel_path = os.path.relpath(path, root)
+            items.append({
+                'key': rel_path,
+                'path': path,
+                'species': infer_species(rel_path, species_names, default_species)
+            })
+    items.sort(key=lambda item: item['key'])
+    return items
+
+
+def read_manifest(path, root=None, default_species=None):
+    """Rows of a CSV or JSONL manifest with a ``path`` and optional ``species`` and ``id``.
+
+    Relative paths are resolved against ``root``, or the manifest's own
+    directory when no root is given.
+    """
+    root = root if root is not None else os.path.dirname(os.path.abspath(path))
+    with open(path, newline='') as f:
+        if path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    items = []
+    for row in rows:
+        if not row.get('path'):
+            raise ValueError(f"{path}: every row needs a 'path'")
+        items.append({
+            'key': str(row.get('id') or row['path']),
+            'path': os.path.join(root, row['path']),
+            'species': row.get('species') or default_species
+        })
+    return items
+
+
+class ImageListDataset(Dataset):
+    """Decodes and transforms images in DataLoader workers; failures become error rows"""
+
+    def __init__(self, items, transform):
+        self.items = items
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        try:
+            return idx, self.transform(load_pil(self.items[idx]['path'], min_size=RESIZE_TO)), None
+        except Exception as e:
+            return idx, None, str(e)
+
+
+def keep_samples(samples):
+    # Tensors are stacked by the classifier; failed decodes have no tensor
+    return samples
+
+
+class JsonlOutput:
+    """Appends one JSON line per image, flushed after every batch"""
+
+    def __init__(self, path):
+        self.path = path
+        self._repair()
+        self._file = open(path, 'a')
+
+    def _repair(self):
+        # A crash mid-write can leave a partial last line; cut it so appends stay valid
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def existing(self):
+        """Rows already written by an earlier run"""
+        with open(self.path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def write(self, rows):
+        for row in rows:
+            self._file.write(json.dumps(row) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetOutput:
+    """Writes a directory of Parquet part files, each renamed into place when complete"""
+
+    def __init__(self, path, rows_per_part=2000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self._pending = []
+        os.makedirs(path, exist_ok=True)
+        self._parts = len(self._part_files())
+
+    def _part_files(self):
+        return sorted(glob.glob(os.path.join(self.path, 'part-*.parquet')))
+
+    def existing(self):
+        rows = []
+        for part in self._part_files():
+            rows.extend(self.pq.read_table(part).to_pylist())
+        return rows
+
+    def write(self, rows):
+        self._pending.extend(rows)
+        if len(self._pending) >= self.rows_per_part:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        table = self.pa.Table.from_pylist(self._pending, schema=self.pa.schema([
+            ('key', self.pa.string()),
+            ('path', self.pa.string()),
+            ('species', self.pa.string()),
+            ('prediction', self.pa.string()),
+            ('full_prediction', self.pa.string()),
+            ('confidence', self.pa.float64()),
+            ('class_probabilities', self.pa.string()),
+            ('error', self.pa.string()),
+            ('model_version', self.pa.string())
+        ]))
+        part = os.path.join(self.path, f'part-{self._parts:05d}.parquet')
+        self.pq.write_table(table, part + '.tmp')
+        os.replace(part + '.tmp', part)
+        self._parts += 1
+        self._pending = []
+
+    def close(self):
+        self._flush()
+
+
+def open_output(path, output_format, rows_per_part):
+    if output_format == 'auto':
+        output_format = 'parquet' if path.endswith('.parquet') else 'jsonl'
+    if output_format == 'parquet':
+        return ParquetOutput(path, rows_per_part)
+    return JsonlOutput(path)
+
+
+def to_row(item, result, model_version, flatten_probabilities=False):
+    probabilities = result.get('class_probabilities')
+    if flatten_probabilities and probabilities is not None:
+        probabilities = json.dumps(probabilities)
+    return {
+        'key': item['key'],
+        'path': item['path'],
+        'species': item['species'],
+        'prediction': result.get('prediction'),
+        'full_prediction': result.get('full_prediction'),
+        'confidence': result.get('confidence'),
+        'class_probabilities': probabilities,
+        'error': result.get('error'),
+        'model_version': model_version
+    }
+
+
+def index_rows(index, items, results, model_version):
+    """Add the embeddings of successfully scored images to a similarity index"""
+    vectors, metadata = [], []
+    for item, result in zip(items, results):
+        embedding = result.pop('embedding', None)
+        if embedding is None:
+            continue
+        vectors.append(embedding)
+        metadata.append({
+            'id': item['key'],
+            'species': item['species'],
+            'prediction': result['prediction'],
+            'confidence': result['confidence'],
+            'model_version': model_version,
+            'source': 'bulk',
+            'path': item['path'],
+            'added': time.time()
+        })
+    index.add(vectors, metadata)
+
+
+def score(classifier, items, output, batch_size=32, workers=4, log_every=10.0, index=None):
+    """Score ``items`` in batches and hand each batch's rows to ``output`` as it finishes.
+
+    With ``index`` set, each image's embedding is also added to that
+    similarity index (the cascade is skipped, as embeddings need the full model).
+    """
+    loader = DataLoader(ImageListDataset(items, classifier.transform), batch_size=batch_size,
+                        num_workers=workers, collate_fn=keep_samples)
+    flatten = isinstance(output, ParquetOutput)
+    counts = {'scored': 0, 'errors': 0}
+    start = last_log = time.perf_counter()
+
+    for samples in loader:
+        rows = []
+        tensors, scored = [], []
+        for idx, tensor, error in samples:
+            item = items[idx]
+            if error is not None:
+                rows.append(to_row(item, {'error': error}, classifier.model_version, flatten))
+            elif item['species'] not in classifier.species_ids:
+                rows.append(to_row(item, {'error': f"No classes found for species: {item['species']}"},
+                                   classifier.model_version, flatten))
+            else:
+                tensors.append(tensor)
+                scored.append(item)
+
+        if tensors:
+            results = classifier.predict_tensors(tensors, [item['species'] for item in scored],
+                                                 embeddings=index is not None)
+            if index is not None:
+                index_rows(index, scored, results, classifier.model_version)
+            rows.extend(to_row(item, result, classifier.model_version, flatten)
+                        for item, result in zip(scored, results))
+        output.write(rows)
+
+        counts['scored'] += len(rows)
+        counts['errors'] += sum(row['error'] is not None for row in rows)
+        now = time.perf_counter()
+        if now - last_log >= log_every or counts['scored'] == len(items):
+            rate = counts['scored'] / (now - start)
+            remaining = (len(items) - counts['scored']) / rate if rate else 0.0
+            print(f"{counts['scored']}/{len(items)} images, {counts['errors']} errors, "
+                  f"{rate:.1f} images/s, ETA {remaining:.0f}s", flush=True)
+            last_log = now
+
+    counts['seconds'] = time.perf_counter() - start
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a directory tree or manifest of images in bulk')
+    parser.add_argument('input', help='Image directory, or a .csv/.jsonl manifest with path[,species][,id] columns')
+    parser.add_argument('--output', default='scores.jsonl',
+                        help='.jsonl file, or a directory of Parquet parts when it ends in .parquet')
+    parser.add_argument('--format', choices=['auto', 'jsonl', 'parquet'], default='auto')
+    parser.add_argument('--model', default=os.environ.get('MODEL_PATH', 'best_model.pth'))
+    parser.add_argument('--backend', default=os.environ.get('MODEL_BACKEND', 'auto'))
+    parser.add_argument('--student', default=os.environ.get('CASCADE_MODEL_PATH'),
+                        help='Distilled student to run as a cascade in front of --model')
+    parser.add_argument('--cascade-threshold', type=float, default=float(os.environ.get('CASCADE_THRESHOLD', 0.9)))
+    parser.add_argument('--species', choices=['dog', 'cat'], default=None,
+                        help='Species for images whose path or manifest row does not name one')
+    parser.add_argument('--root', default=None, help='Base directory for relative manifest paths')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4, help='Decode processes')
+    parser.add_argument('--rows-per-part', type=int, default=2000, help='Parquet rows per part file')
+    parser.add_argument('--log-every', type=float, default=10.0, help='Seconds between progress lines')
+    parser.add_argument('--index', default=None,
+                        help='Also add embeddings to this similarity index (SIMILARITY_INDEX_DIR of the service)')
+    args = parser.parse_args()
+
+    classifier = SkinDiseaseClassifier(args.model, backend=args.backend, student_path=args.student,
+                                       cascade_threshold=args.cascade_threshold)
+    index = None
+    if args.index:
+        if classifier.embedding_version is None:
+            raise SystemExit('--index needs an eager checkpoint as --model')
+        from vector_index import VectorIndex
+        index = VectorIndex(args.index, classifier.embedding_dim, classifier.embedding_version)
+        if index.version != classifier.embedding_version:
+            raise SystemExit(f"{args.index} was built with model {index.version}, not {classifier.embedding_version}")
+    if os.path.isdir(args.input):
+        items = list_directory(args.input, classifier.species_ids, args.species)
+    else:
+        items = read_manifest(args.input, args.root, args.species)
+
+    output = open_output(args.output, args.format, args.rows_per_part)
+
+    # Resume: skip every key already in the output; use a new --output to start over
+    done = output.existing()
+    done_keys = {row['key'] for row in done}
+    other_versions = {row['model_version'] for row in done} - {classifier.model_version}
+    if other_versions:
+        print(f"Warning: {args.output} also holds scores from model version(s) {sorted(other_versions)}")
+    pending = [item for item in items if item['key'] not in done_keys]
+    print(f"{len(items)} images, {len(items) - len(pending)} already scored, {len(pending)} to go "
+          f"(model {classifier.model_version})")
+
+    try:
+        counts = score(classifier, pending, output, args.batch_size, args.workers, args.log_every, index)
+    finally:
+        output.close()
+    rate = counts['scored'] / counts['seconds'] if counts['seconds'] else 0.0
+    print(f"Scored {counts['scored']} images ({counts['errors']} errors) in {counts['seconds']:.1f}s, "
+          f"{rate:.1f} images/s; results in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
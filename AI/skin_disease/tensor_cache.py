@@ -0,0 +1,174 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+from multiprocessing import Pool
+
+import numpy as np
+import torch
+from PIL import Image, ImageFile
+from torch.utils.data import Dataset
+from torchvision import datasets
+
+# Same decoder as serving, so cached training images get the same EXIF rotation
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from imaging import load_pil
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# Train images keep some border around the 224 crop so RandomResizedCrop
+# still has room to work; valid images are stored already center-cropped.
+STORED_SIZE = {'train': 256, 'valid': 224}
+RESIZE_TO = {'train': 256, 'valid': 256}
+SHARD_SIZE = 2048
+
+
+def _decode(args):
+    """Decode, resize the short side and center-crop one image to uint8 HxWx3"""
+    path, resize_to, size = args
+    try:
+        img = load_pil(path, min_size=resize_to)
+        scale = resize_to / min(img.size)
+        img = img.resize((max(size, round(img.width * scale)), max(size, round(img.height * scale))),
+                         Image.BILINEAR)
+        left = (img.width - size) // 2
+        top = (img.height - size) // 2
+        return np.asarray(img.crop((left, top, left + size, top + size)), dtype=np.uint8)
+    except Exception as e:
+        print(f"Skipping unreadable image {path}: {str(e)}")
+        return None
+
+
+def source_fingerprint(folder, data_dir, split):
+    """Hash of a split's classes, file list, labels, sizes and mtimes and the stored image size"""
+    digest = hashlib.sha256(json.dumps([folder.classes, STORED_SIZE[split], RESIZE_TO[split]]).encode())
+    for path, label in folder.samples:
+        stat = os.stat(path)
+        digest.update(f'{os.path.relpath(path, data_dir)}\0{label}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()
+
+
+def build_split(data_dir, cache_dir, split, workers=None, shard_size=SHARD_SIZE):
+    """Decode one ImageFolder split into memory-mapped uint8 shards plus an index"""
+    folder = datasets.ImageFolder(os.path.join(data_dir, split))
+    fingerprint = source_fingerprint(folder, data_dir, split)
+    size = STORED_SIZE[split]
+    out_dir = os.path.join(cache_dir, split)
+    os.makedirs(out_dir, exist_ok=True)
+    # The index goes first so a rebuild that dies part-way is never mistaken for a cache
+    for stale in [os.path.join(out_dir, 'index.json')] + glob.glob(os.path.join(out_dir, 'shard_*.npy')):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    shards, labels, sources = [], [], []
+    jobs = [(path, RESIZE_TO[split], size) for path, _ in folder.samples]
+    with Pool(workers) as pool:
+        for start in range(0, len(jobs), shard_size):
+            chunk = folder.samples[start:start + shard_size]
+            images = pool.map(_decode, jobs[start:start + shard_size], chunksize=16)
+            kept = [(img, sample) for img, sample in zip(images, chunk) if img is not None]
+            if not kept:
+                continue
+
+            name = f'shard_{len(shards):05d}.npy'
+            shard = np.lib.format.open_memmap(
+                os.path.join(out_dir, name), mode='w+', dtype=np.uint8, shape=(len(kept), size, size, 3)
+            )
+            for i, (img, (path, label)) in enumerate(kept):
+                shard[i] = img
+                labels.append(label)
+                sources.append(os.path.relpath(path, data_dir))
+            shard.flush()
+            del shard
+            shards.append({'file': name, 'count': len(kept)})
+            print(f"{split}: wrote {name} ({len(kept)} images)")
+
+    np.save(os.path.join(out_dir, 'labels.npy'), np.asarray(labels, dtype=np.int64))
+    with open(os.path.join(out_dir, 'index.json'), 'w') as f:
+        json.dump({
+            'classes': folder.classes,
+            'image_size': size,
+            'shards': shards,
+            'sources': sources,
+            'fingerprint': fingerprint
+        }, f)
+    return len(labels)
+
+
+def build_cache(data_dir, cache_dir, splits=('train', 'valid'), workers=None):
+    for split in splits:
+        count = build_split(data_dir, cache_dir, split, workers)
+        print(f"Cached {count} {split} images in {os.path.join(cache_dir, split)}")
+
+
+def cache_exists(cache_dir, split, data_dir=None):
+    """True if the split is cached and, given ``data_dir``, still matches its source images"""
+    index_path = os.path.join(cache_dir, split, 'index.json')
+    if not os.path.exists(index_path):
+        return False
+    if data_dir is None or not os.path.isdir(os.path.join(data_dir, split)):
+        # Nothing to compare against, e.g. a cache copied without the raw images
+        return True
+    with open(index_path) as f:
+        stored = json.load(f).get('fingerprint')
+    folder = datasets.ImageFolder(os.path.join(data_dir, split))
+    if stored == source_fingerprint(folder, data_dir, split):
+        return True
+    print(f"{os.path.join(data_dir, split)} changed since {index_path} was built")
+    return False
+
+
+class ShardedImageDataset(Dataset):
+    """Reads images from memory-mapped shards written by ``build_cache``.
+
+    Items are CHW uint8 tensors that view the mapped file directly, so only
+    ``transform`` (random augmentation and normalization) costs anything.
+    """
+
+    def __init__(self, cache_dir, split, transform=None):
+        split_dir = os.path.join(cache_dir, split)
+        with open(os.path.join(split_dir, 'index.json')) as f:
+            index = json.load(f)
+        self.split_dir = split_dir
+        self.classes = index['classes']
+        self.sources = index['sources']
+        self.shard_files = [s['file'] for s in index['shards']]
+        self.offsets = np.cumsum([0] + [s['count'] for s in index['shards']])
+        self.targets = np.load(os.path.join(split_dir, 'labels.npy')).tolist()
+        self.transform = transform
+        self._shards = None
+
+    def _open(self):
+        # Mapped lazily so every DataLoader worker gets its own mapping.
+        # Copy-on-write mode keeps the views writable without copying pages.
+        self._shards = [np.load(os.path.join(self.split_dir, f), mmap_mode='c') for f in self.shard_files]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, idx):
+        if self._shards is None:
+            self._open()
+        shard = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        image = torch.from_numpy(self._shards[shard][idx - self.offsets[shard]]).permute(2, 0, 1)
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, self.targets[idx]
+
+    def __getstate__(self):
+        # Never pickle open mappings into DataLoader workers
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Preprocess ImageFolder splits into memory-mapped shards')
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--cache-dir', default='data_cache')
+    parser.add_argument('--splits', nargs='+', default=['train', 'valid'])
+    parser.add_argument('--workers', type=int, default=None, help='Decode processes (default: all cores)')
+    args = parser.parse_args()
+    build_cache(args.data_dir, args.cache_dir, args.splits, args.workers)
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from predict import SkinDiseaseClassifier, build_network
+
+CLASS_NAMES = ['cat_healthy', 'cat_ringworm', 'dog_healthy', 'dog_ringworm']
+
+
+def write_training_checkpoint(path):
+    """A checkpoint like the ones train_model.py saves: weights plus non-tensor state"""
+    model = build_network('mobilenet_v3_small', len(CLASS_NAMES))
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.01, momentum=0.9)
+    torch.save({
+        'model_state_dict': model.state_dict(),
+        'optimizer_state_dict': optimizer.state_dict(),
+        'class_names': CLASS_NAMES,
+        'arch': 'mobilenet_v3_small',
+        'epoch': 3,
+        'rng': {'numpy': np.random.get_state(), 'torch': torch.get_rng_state()},
+        'sampler': {'epoch': 3, 'position': 17, 'order': np.arange(10)}
+    }, path)
+    return model
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_loads_checkpoint_with_non_tensor_metadata(tmp_path, mmap):
+    path = str(tmp_path / 'best_model.pth')
+    model = write_training_checkpoint(path)
+    with pytest.raises(Exception):
+        torch.load(path, weights_only=True)
+
+    classifier = SkinDiseaseClassifier(path, mmap=mmap)
+
+    assert classifier.class_names == CLASS_NAMES
+    assert classifier.arch == 'mobilenet_v3_small'
+    image = torch.rand(1, 3, 224, 224)
+    model.eval()
+    with torch.no_grad():
+        expected = model(image)
+    torch.testing.assert_close(classifier.forward([image[0]]).float(), expected)
+    result = classifier.predict_tensors([image[0]], ['dog'])[0]
+    assert result['full_prediction'] in ('dog_healthy', 'dog_ringworm')
@@ -2,11 +2,21 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from torchvision import datasets, transforms, models
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, TensorDataset
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
+import argparse
+import contextlib
+import math
 import os
+import time
 import matplotlib.pyplot as plt
 import numpy as np
 from sklearn.metrics import classification_report
+from tensor_cache import ShardedImageDataset, build_cache, cache_exists
+from checkpointing import EarlyStopping, ResumableRandomSampler, load_training_state, save_training_state
+from predict import ARCHITECTURES, build_network
 
 # Set device
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -29,99 +39,582 @@ data_transforms = {
     ]),
 }
 
-# Load datasets
-data_dir = 'data'
-image_datasets = {
-    x: datasets.ImageFolder(os.path.join(data_dir, x), data_transforms[x])
-    for x in ['train', 'valid']
+# Same pipeline for uint8 tensors from the shard cache: images are already
+# decoded and resized, and validation images are already center-cropped
+cached_transforms = {
+    'train': transforms.Compose([
+        transforms.RandomResizedCrop(224, antialias=True),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(20),
+        transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2),
+        transforms.ConvertImageDtype(torch.float),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ]),
+    'valid': transforms.Compose([
+        transforms.ConvertImageDtype(torch.float),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+    ]),
 }
 
-# Get class names from directory structure
-class_names = sorted([d.name for d in os.scandir(os.path.join(data_dir, 'train')) if d.is_dir()])
-num_classes = len(class_names)
+def load_datasets(data_dir, cache_dir=None):
+    """ImageFolder datasets, or shard-cache datasets when cache_dir is given"""
+    if cache_dir is None:
+        return {
+            x: datasets.ImageFolder(os.path.join(data_dir, x), data_transforms[x])
+            for x in ['train', 'valid']
+        }
 
-print(f"Detected {num_classes} classes: {class_names}")
+    # Splits whose images were added, removed or relabelled since caching are rebuilt
+    missing = [x for x in ['train', 'valid'] if not cache_exists(cache_dir, x, data_dir)]
+    if missing:
+        print(f"Building tensor cache for {missing} in {cache_dir}...")
+        build_cache(data_dir, cache_dir, missing)
+    return {
+        x: ShardedImageDataset(cache_dir, x, cached_transforms[x])
+        for x in ['train', 'valid']
+    }
 
-# Create dataloaders
-batch_size = 32
-dataloaders = {
-    x: DataLoader(image_datasets[x], batch_size=batch_size, shuffle=True, num_workers=4)
-    for x in ['train', 'valid']
-}
+def build_model(num_classes, init_from=None):
+    # Load and modify ResNet model
+    model = models.resnet50(weights='ResNet50_Weights.DEFAULT')
+    if init_from is not None:
+        # Start from an earlier fine-tuned backbone; the head is rebuilt below
+        # because the new class list may differ
+        checkpoint = torch.load(init_from, map_location='cpu')
+        backbone = {k: v for k, v in checkpoint['model_state_dict'].items() if not k.startswith('fc.')}
+        model.load_state_dict(backbone, strict=False)
+    num_ftrs = model.fc.in_features
+    model.fc = nn.Linear(num_ftrs, num_classes)
+    return model.to(device)
+
+def autocast(enabled):
+    """bf16 autocast on the current device; a no-op when disabled"""
+    return torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=enabled)
+
+def to_memory_format(inputs, channels_last):
+    if channels_last:
+        return inputs.to(device, memory_format=torch.channels_last)
+    return inputs.to(device)
+
+def setup_distributed():
+    """Join the gloo process group when started by torchrun; returns (rank, world_size).
 
-dataset_sizes = {x: len(image_datasets[x]) for x in ['train', 'valid']}
+    torchrun sets RANK, WORLD_SIZE, MASTER_ADDR and MASTER_PORT for every
+    process, on one host or across several; a plain ``python train_model.py``
+    stays single-process.
+    """
+    if int(os.environ.get('WORLD_SIZE', 1)) <= 1:
+        return 0, 1
+    dist.init_process_group('gloo')
+    return dist.get_rank(), dist.get_world_size()
 
-# Load and modify ResNet model
-model = models.resnet50(weights='ResNet50_Weights.DEFAULT')
-num_ftrs = model.fc.in_features
-model.fc = nn.Linear(num_ftrs, num_classes)
-model = model.to(device)
+@contextlib.contextmanager
+def main_process_first(rank):
+    """Let rank 0 build shared files (tensor cache, downloaded weights) before the other ranks read them"""
+    if rank != 0:
+        dist.barrier()
+    yield
+    if rank == 0 and dist.is_initialized():
+        dist.barrier()
 
-# Define loss function and optimizer with weight decay
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.SGD(model.parameters(), lr=0.001, momentum=0.9, weight_decay=1e-4)
-scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=7, gamma=0.1)
+def scaled_lr(base_lr, batch_size, base_batch_size=32, rule='linear'):
+    """Scale a learning rate tuned at ``base_batch_size`` to an effective batch size"""
+    ratio = batch_size / base_batch_size
+    if rule == 'linear':
+        return base_lr * ratio
+    if rule == 'sqrt':
+        return base_lr * math.sqrt(ratio)
+    return base_lr
+
+def all_reduce_sum(values):
+    """Sum a list of numbers across ranks (identity when not distributed)"""
+    if not dist.is_initialized():
+        return values
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
 
 # Training function
-def train_model(model, criterion, optimizer, scheduler, num_epochs=25):
+def train_model(model, criterion, optimizer, scheduler, dataloaders, class_names, num_epochs=25,
+                use_bf16=False, channels_last=False, checkpoint_path='checkpoint_last.pth',
+                checkpoint_every=200, resume=False, early_stopping=None, accumulate_steps=1):
+    """Fine-tune ``model``, in DistributedDataParallel when a process group is up.
+
+    Gradients are accumulated over ``accumulate_steps`` batches per optimizer
+    step and ``checkpoint_every`` counts optimizer steps. Under DDP every rank
+    trains on its own shard and sees the same all-reduced metrics, so they
+    all stop early together; only rank 0 writes files or prints.
+    """
+    distributed = dist.is_initialized()
+    is_main = not distributed or dist.get_rank() == 0
+    report = print if is_main else (lambda *a, **k: None)
+    sampler = dataloaders['train'].sampler
+    world_size = dist.get_world_size() if distributed else 1
+    # Samples the ranks see together per epoch, padding included
+    dataset_sizes = {
+        x: dataloaders[x].sampler.num_samples * world_size if distributed else len(dataloaders[x].dataset)
+        for x in ['train', 'valid']
+    }
     best_acc = 0.0
+    start_epoch, start_step = 0, 0
+    running = {'loss': 0.0, 'corrects': 0}
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    if resume and os.path.exists(checkpoint_path):
+        # Every rank reads the same file, so multi-host runs need it on shared storage
+        state = load_training_state(checkpoint_path, map_location=device)
+        model.load_state_dict(state['model_state_dict'])
+        optimizer.load_state_dict(state['optimizer_state_dict'])
+        scheduler.load_state_dict(state['scheduler_state_dict'])
+        if early_stopping is not None and state['early_stopping'] is not None:
+            early_stopping.load_state_dict(state['early_stopping'])
+        best_acc = state['best_acc']
+        start_epoch, start_step = state['epoch'], state['step']
+        running = state['running']
+        report(f"Resumed from {checkpoint_path} at epoch {start_epoch}, step {start_step}")
+    elif resume:
+        report(f"No checkpoint at {checkpoint_path}; starting from scratch")
+
+    # Wrapped after resuming and the memory-format change so DDP sees the final parameters
+    module = model
+    if distributed:
+        model = DistributedDataParallel(model)
+
+    def save_checkpoint(epoch, step):
+        if not is_main:
+            return
+        save_training_state(
+            checkpoint_path,
+            epoch=epoch,
+            step=step,
+            model_state_dict=module.state_dict(),
+            optimizer_state_dict=optimizer.state_dict(),
+            scheduler_state_dict=scheduler.state_dict(),
+            sampler=sampler.state_dict() if hasattr(sampler, 'state_dict') else None,
+            early_stopping=early_stopping.state_dict() if early_stopping is not None else None,
+            best_acc=best_acc,
+            running=dict(running),
+            class_names=class_names
+        )
     
-    for epoch in range(num_epochs):
-        print(f'Epoch {epoch}/{num_epochs - 1}')
-        print('-' * 10)
+    for epoch in range(start_epoch, num_epochs):
+        report(f'Epoch {epoch}/{num_epochs - 1}')
+        report('-' * 10)
+
+        # Skip the batches an interrupted run already trained on this epoch
+        skip_step = start_step if epoch == start_epoch else 0
+        if hasattr(sampler, 'set_epoch'):
+            batch_size = dataloaders['train'].batch_size
+            sampler.set_epoch(epoch, skip_step * batch_size)
+        if skip_step == 0:
+            running = {'loss': 0.0, 'corrects': 0}
         
         for phase in ['train', 'valid']:
+            phase_start = time.perf_counter()
             if phase == 'train':
                 model.train()
+                step = skip_step
+                # Resuming mid-epoch always happens on an optimizer-step boundary
+                last_batch = skip_step + len(dataloaders['train'])
+                optimizer.zero_grad()
             else:
                 model.eval()
-                
-            running_loss = 0.0
-            running_corrects = 0
+                running = {'loss': 0.0, 'corrects': 0}
+            # Validation runs on the unwrapped model: no gradient sync needed,
+            # and ranks may get a different number of batches
+            net = model if phase == 'train' else module
             
             for inputs, labels in dataloaders[phase]:
-                inputs = inputs.to(device)
+                inputs = to_memory_format(inputs, channels_last)
                 labels = labels.to(device)
+                update = phase == 'train' and ((step + 1) % accumulate_steps == 0 or step + 1 == last_batch)
+                # Between optimizer steps DDP can skip the gradient all-reduce
+                sync = contextlib.nullcontext()
+                if distributed and phase == 'train' and not update:
+                    sync = model.no_sync()
                 
-                optimizer.zero_grad()
-                
-                with torch.set_grad_enabled(phase == 'train'):
-                    outputs = model(inputs)
+                with torch.set_grad_enabled(phase == 'train'), sync:
+                    with autocast(use_bf16):
+                        outputs = net(inputs)
+                        loss = criterion(outputs, labels)
                     _, preds = torch.max(outputs, 1)
-                    loss = criterion(outputs, labels)
                     
                     if phase == 'train':
-                        loss.backward()
-                        optimizer.step()
+                        (loss / accumulate_steps).backward()
+                        if update:
+                            optimizer.step()
+                            optimizer.zero_grad()
                 
-                running_loss += loss.item() * inputs.size(0)
-                running_corrects += torch.sum(preds == labels.data)
+                running['loss'] += loss.item() * inputs.size(0)
+                running['corrects'] += torch.sum(preds == labels.data).item()
+
+                if phase == 'train':
+                    step += 1
+                    if checkpoint_every and update and step % (checkpoint_every * accumulate_steps) == 0:
+                        save_checkpoint(epoch, step)
             
             if phase == 'train':
                 scheduler.step()
             
-            epoch_loss = running_loss / dataset_sizes[phase]
-            epoch_acc = running_corrects.double() / dataset_sizes[phase]
+            total_loss, total_corrects = all_reduce_sum([running['loss'], running['corrects']])
+            epoch_loss = total_loss / dataset_sizes[phase]
+            epoch_acc = total_corrects / dataset_sizes[phase]
+            elapsed = time.perf_counter() - phase_start
             
-            print(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+            report(f'{phase} Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f} ({elapsed:.1f}s)')
             
             if phase == 'valid' and epoch_acc > best_acc:
                 best_acc = epoch_acc
-                torch.save({
-                    'epoch': epoch,
-                    'model_state_dict': model.state_dict(),
-                    'optimizer_state_dict': optimizer.state_dict(),
-                    'loss': epoch_loss,
-                    'acc': epoch_acc,
-                    'class_names': class_names
-                }, 'best_model.pth')
+                if is_main:
+                    torch.save({
+                        'epoch': epoch,
+                        'model_state_dict': module.state_dict(),
+                        'optimizer_state_dict': optimizer.state_dict(),
+                        'loss': epoch_loss,
+                        'acc': epoch_acc,
+                        'class_names': class_names
+                    }, 'best_model.pth')
+
+        stop = early_stopping is not None and early_stopping.step(epoch_loss, epoch_acc)
+        # Epoch boundary: a resume starts cleanly at the next epoch
+        running = {'loss': 0.0, 'corrects': 0}
+        save_checkpoint(epoch + 1, 0)
                 
-        print()
+        report()
+
+        if stop:
+            report(f'Early stopping: validation {early_stopping.monitor} has not improved '
+                   f'for {early_stopping.bad_epochs} epochs')
+            break
     
+    report(f'Best validation Accuracy: {best_acc:4f}')
+    return module
+
+def extract_features(backbone, dataset, batch_size, workers, use_bf16=False, channels_last=False):
+    """Pooled 2048-d backbone features and labels for a whole dataset"""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=workers)
+    features, labels = [], []
+    backbone.eval()
+    with torch.no_grad():
+        for inputs, targets in loader:
+            with autocast(use_bf16):
+                outputs = backbone(to_memory_format(inputs, channels_last))
+            features.append(outputs.float().cpu())
+            labels.append(targets)
+    return torch.cat(features), torch.cat(labels)
+
+def cached_features(path, backbone, backbone_id, dataset, batch_size, workers, use_bf16=False, channels_last=False):
+    """Load features from disk, computing them once if missing or stale"""
+    if os.path.exists(path):
+        cached = torch.load(path)
+        if (cached['backbone'] == backbone_id and cached['num_samples'] == len(dataset)
+                and cached['classes'] == dataset.classes):
+            print(f"Using cached features from {path}")
+            return cached['features'], cached['labels']
+    print(f"Extracting features for {len(dataset)} images...")
+    features, labels = extract_features(backbone, dataset, batch_size, workers, use_bf16, channels_last)
+    torch.save({
+        'features': features,
+        'labels': labels,
+        'backbone': backbone_id,
+        'num_samples': len(dataset),
+        'classes': dataset.classes
+    }, path)
+    return features, labels
+
+def train_linear_probe(model, features, class_names, num_epochs=50, batch_size=256, lr=1e-3):
+    """Train only model.fc on precomputed features, saving the full model on improvement"""
+    head = model.fc
+    dataloaders = {
+        x: DataLoader(TensorDataset(*features[x]), batch_size=batch_size, shuffle=(x == 'train'))
+        for x in ['train', 'valid']
+    }
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(head.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=num_epochs)
+    best_acc = 0.0
+
+    for epoch in range(num_epochs):
+        for phase in ['train', 'valid']:
+            head.train(phase == 'train')
+            running_loss = 0.0
+            running_corrects = 0
+
+            for inputs, labels in dataloaders[phase]:
+                inputs, labels = inputs.to(device), labels.to(device)
+                optimizer.zero_grad()
+                with torch.set_grad_enabled(phase == 'train'):
+                    outputs = head(inputs)
+                    loss = criterion(outputs, labels)
+                    if phase == 'train':
+                        loss.backward()
+                        optimizer.step()
+                running_loss += loss.item() * inputs.size(0)
+                running_corrects += torch.sum(outputs.argmax(1) == labels).item()
+
+            if phase == 'train':
+                scheduler.step()
+
+            size = len(dataloaders[phase].dataset)
+            epoch_loss = running_loss / size
+            epoch_acc = running_corrects / size
+
+            if phase == 'valid':
+                print(f'Epoch {epoch}/{num_epochs - 1} valid Loss: {epoch_loss:.4f} Acc: {epoch_acc:.4f}')
+                if epoch_acc > best_acc:
+                    best_acc = epoch_acc
+                    torch.save({
+                        'epoch': epoch,
+                        'model_state_dict': model.state_dict(),
+                        'optimizer_state_dict': optimizer.state_dict(),
+                        'loss': epoch_loss,
+                        'acc': epoch_acc,
+                        'class_names': class_names
+                    }, 'best_model.pth')
+
     print(f'Best validation Accuracy: {best_acc:4f}')
     return model
 
+def run_linear_probe(args, model, class_names):
+    """Cache frozen-backbone features for the non-augmented splits, then fit the head"""
+    # Both splits go through the fixed validation preprocessing
+    if args.cache_dir is None:
+        probe_datasets = {
+            x: datasets.ImageFolder(os.path.join(args.data_dir, x), data_transforms['valid'])
+            for x in ['train', 'valid']
+        }
+    else:
+        probe_datasets = {
+            'train': ShardedImageDataset(args.cache_dir, 'train', transforms.Compose([
+                transforms.CenterCrop(224), cached_transforms['valid']
+            ])),
+            'valid': ShardedImageDataset(args.cache_dir, 'valid', cached_transforms['valid'])
+        }
+
+    # Features depend on which backbone weights and which images produced them
+    if args.init_from is None:
+        backbone_id = 'imagenet'
+    else:
+        backbone_id = f'{os.path.abspath(args.init_from)}@{os.path.getmtime(args.init_from)}'
+    backbone_id += f'|{os.path.abspath(args.cache_dir or args.data_dir)}'
+
+    head = model.fc
+    model.fc = nn.Identity()
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    os.makedirs(args.feature_cache, exist_ok=True)
+    features = {
+        x: cached_features(os.path.join(args.feature_cache, f'{x}.pt'), model, backbone_id, probe_datasets[x],
+                           args.batch_size, args.workers, args.bf16, args.channels_last)
+        for x in ['train', 'valid']
+    }
+    model.fc = head
+
+    return train_linear_probe(model, features, class_names, num_epochs=args.epochs)
+
+def load_teacher(checkpoint_path, class_names):
+    """Frozen fine-tuned model whose outputs a student is trained to match"""
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    if checkpoint['class_names'] != class_names:
+        raise ValueError(f"{checkpoint_path} was trained on different classes than the dataset")
+    teacher = build_network(checkpoint.get('arch', 'resnet50'), len(class_names))
+    teacher.load_state_dict(checkpoint['model_state_dict'])
+    for param in teacher.parameters():
+        param.requires_grad = False
+    return teacher.to(device).eval()
+
+def distillation_loss(student_logits, teacher_logits, labels, temperature, alpha):
+    """Blend of KL to the teacher's softened outputs and cross-entropy to the labels"""
+    soft = nn.functional.kl_div(
+        nn.functional.log_softmax(student_logits / temperature, dim=1),
+        nn.functional.softmax(teacher_logits / temperature, dim=1),
+        reduction='batchmean'
+    ) * temperature ** 2
+    return alpha * soft + (1 - alpha) * nn.functional.cross_entropy(student_logits, labels)
+
+def distill_model(student, teacher, arch, dataloaders, class_names, num_epochs=20, lr=1e-3,
+                  temperature=4.0, alpha=0.7, use_bf16=False, channels_last=False,
+                  output_path='student_model.pth'):
+    """Train a small student on the teacher's outputs for the prediction cascade.
+
+    The teacher scores the same augmented batch the student sees. The best
+    epoch by validation agreement with the teacher is saved as an
+    inference-only checkpoint that SkinDiseaseClassifier can load.
+    """
+    optimizer = optim.AdamW(student.parameters(), lr=lr, weight_decay=1e-4)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=num_epochs)
+    if channels_last:
+        student = student.to(memory_format=torch.channels_last)
+        teacher = teacher.to(memory_format=torch.channels_last)
+    best_agreement = 0.0
+
+    for epoch in range(num_epochs):
+        for phase in ['train', 'valid']:
+            student.train(phase == 'train')
+            running = {'loss': 0.0, 'corrects': 0, 'agree': 0}
+
+            for inputs, labels in dataloaders[phase]:
+                inputs = to_memory_format(inputs, channels_last)
+                labels = labels.to(device)
+                optimizer.zero_grad()
+
+                with torch.no_grad(), autocast(use_bf16):
+                    teacher_logits = teacher(inputs).float()
+                with torch.set_grad_enabled(phase == 'train'):
+                    with autocast(use_bf16):
+                        outputs = student(inputs)
+                    loss = distillation_loss(outputs.float(), teacher_logits, labels, temperature, alpha)
+                    if phase == 'train':
+                        loss.backward()
+                        optimizer.step()
+
+                preds = outputs.argmax(1)
+                running['loss'] += loss.item() * inputs.size(0)
+                running['corrects'] += torch.sum(preds == labels).item()
+                running['agree'] += torch.sum(preds == teacher_logits.argmax(1)).item()
+
+            if phase == 'train':
+                scheduler.step()
+
+            size = len(dataloaders[phase].dataset)
+            epoch_acc = running['corrects'] / size
+            agreement = running['agree'] / size
+            print(f"Epoch {epoch}/{num_epochs - 1} {phase} Loss: {running['loss'] / size:.4f} "
+                  f"Acc: {epoch_acc:.4f} Agreement: {agreement:.4f}")
+
+            if phase == 'valid' and agreement > best_agreement:
+                best_agreement = agreement
+                torch.save({
+                    'epoch': epoch,
+                    'arch': arch,
+                    'model_state_dict': student.state_dict(),
+                    'acc': epoch_acc,
+                    'agreement': agreement,
+                    'class_names': class_names
+                }, output_path)
+
+    print(f'Best validation agreement with the teacher: {best_agreement:4f} (saved to {output_path})')
+    return student
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the ResNet-50 skin condition classifier')
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Read preprocessed shards from here (built on first use, see tensor_cache.py)')
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--bf16', action='store_true', help='Run forward passes under bf16 autocast')
+    parser.add_argument('--channels-last', action='store_true', help='Use channels_last memory format')
+    parser.add_argument('--linear-probe', action='store_true',
+                        help='Freeze the backbone and train only the fc head on cached features')
+    parser.add_argument('--feature-cache', default='feature_cache',
+                        help='Where --linear-probe stores backbone features')
+    parser.add_argument('--init-from', default=None,
+                        help='Initialize the backbone from an earlier checkpoint such as best_model.pth')
+    parser.add_argument('--checkpoint', default='checkpoint_last.pth',
+                        help='Full training state written periodically for --resume')
+    parser.add_argument('--checkpoint-every', type=int, default=200,
+                        help='Also checkpoint every N optimizer steps (0: only at epoch end)')
+    parser.add_argument('--resume', action='store_true', help='Continue from --checkpoint if it exists')
+    parser.add_argument('--patience', type=int, default=None,
+                        help='Stop after this many epochs without validation improvement')
+    parser.add_argument('--min-delta', type=float, default=0.0)
+    parser.add_argument('--monitor', choices=['loss', 'acc'], default='loss')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--distill-from', default=None,
+                        help='Train a small --student on the outputs of this checkpoint instead (cascade mode)')
+    parser.add_argument('--student', choices=[a for a in ARCHITECTURES if a != 'resnet50'],
+                        default='mobilenet_v3_large')
+    parser.add_argument('--student-output', default='student_model.pth')
+    parser.add_argument('--temperature', type=float, default=4.0, help='Softmax temperature for distillation')
+    parser.add_argument('--distill-alpha', type=float, default=0.7,
+                        help='Weight of the teacher term; the rest goes to the labels')
+    parser.add_argument('--lr', type=float, default=0.001, help='Learning rate at --base-batch-size')
+    parser.add_argument('--base-batch-size', type=int, default=32)
+    parser.add_argument('--lr-scaling', choices=['linear', 'sqrt', 'none'], default='linear',
+                        help='How --lr grows with the effective batch (batch size x processes x accumulation)')
+    parser.add_argument('--accumulate-steps', type=int, default=1,
+                        help='Batches whose gradients are summed per optimizer step')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Intra-op threads per process (default: cores / processes on this host)')
+    args = parser.parse_args()
+
+    # Distributed when launched with torchrun, e.g. on each of two hosts:
+    #   torchrun --nnodes 2 --nproc-per-node 8 --rdzv-backend c10d \
+    #       --rdzv-endpoint host0:29500 train_model.py --cache-dir cache
+    rank, world_size = setup_distributed()
+    if world_size > 1 and (args.linear_probe or args.distill_from):
+        parser.error('--linear-probe and --distill-from run single-process only')
+    # torchrun defaults every process to one thread; split the host's cores instead
+    local_world_size = int(os.environ.get('LOCAL_WORLD_SIZE', 1))
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // local_world_size))
+    # Same seed everywhere so all ranks start from identical weights
+    torch.manual_seed(args.seed)
+    report = print if rank == 0 else (lambda *a, **k: None)
+
+    # Load datasets
+    with main_process_first(rank):
+        image_datasets = load_datasets(args.data_dir, args.cache_dir)
+
+    # Get class names from directory structure
+    class_names = image_datasets['train'].classes
+    num_classes = len(class_names)
+
+    report(f"Detected {num_classes} classes: {class_names}")
+
+    # Create dataloaders; the train order comes from a sampler that can
+    # resume mid-epoch, and each rank gets its own shard of both splits
+    samplers = {
+        'train': ResumableRandomSampler(image_datasets['train'], seed=args.seed,
+                                        num_replicas=world_size, rank=rank),
+        'valid': DistributedSampler(image_datasets['valid'], world_size, rank, shuffle=False) if world_size > 1 else None
+    }
+    dataloaders = {
+        x: DataLoader(image_datasets[x], batch_size=args.batch_size, sampler=samplers[x],
+                      num_workers=args.workers, persistent_workers=args.workers > 0)
+        for x in ['train', 'valid']
+    }
+
+    if args.distill_from is not None:
+        print(f"Distilling {args.distill_from} into {args.student}...")
+        teacher = load_teacher(args.distill_from, class_names)
+        student = build_network(args.student, num_classes, pretrained=True).to(device)
+        distill_model(student, teacher, args.student, dataloaders, class_names, num_epochs=args.epochs,
+                      temperature=args.temperature, alpha=args.distill_alpha, use_bf16=args.bf16,
+                      channels_last=args.channels_last, output_path=args.student_output)
+        print("Training complete!")
+        return
+
+    with main_process_first(rank):
+        model = build_model(num_classes, args.init_from)
+
+    if args.linear_probe:
+        print("Training linear probe...")
+        run_linear_probe(args, model, class_names)
+        print("Training complete!")
+        return
+
+    # Define loss function and optimizer with weight decay
+    effective_batch = args.batch_size * world_size * args.accumulate_steps
+    lr = scaled_lr(args.lr, effective_batch, args.base_batch_size, args.lr_scaling)
+    criterion = nn.CrossEntropyLoss()
+    optimizer = optim.SGD(model.parameters(), lr=lr, momentum=0.9, weight_decay=1e-4)
+    scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=7, gamma=0.1)
+
+    report(f"Training model on {world_size} process(es), effective batch {effective_batch}, lr {lr:g}...")
+    early_stopping = None
+    if args.patience is not None:
+        early_stopping = EarlyStopping(args.patience, args.min_delta, args.monitor)
+    model = train_model(model, criterion, optimizer, scheduler, dataloaders, class_names, num_epochs=args.epochs,
+                        use_bf16=args.bf16, channels_last=args.channels_last,
+                        checkpoint_path=args.checkpoint, checkpoint_every=args.checkpoint_every,
+                        resume=args.resume, early_stopping=early_stopping,
+                        accumulate_steps=args.accumulate_steps)
+    report("Training complete!")
+    if world_size > 1:
+        dist.destroy_process_group()
+
 if __name__ == '__main__':
-    print("Training model...")
-    model = train_model(model, criterion, optimizer, scheduler, num_epochs=20)
-    print("Training complete!")
+    main()
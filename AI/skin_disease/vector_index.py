@@ -0,0 +1,267 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+
+# fcntl is POSIX-only; Windows locks a byte of the lock file with msvcrt instead
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+VECTOR_DTYPE = np.float16
+
+
+class VectorIndex:
+    """Append-only on-disk store of image embeddings with brute-force cosine search.
+
+    Rows live in flat files that are memory-mapped for search, so the index
+    never has to fit in RAM:
+
+    - ``vectors.f16``: L2-normalized float16 embeddings, ``dim`` per row
+    - ``species.u8``: one species code per row, for filtered search
+    - ``offsets.u64``: byte offset of each row's metadata in ``meta.jsonl``
+    - ``index.json``: dim, species codes and the model version
+
+    Several processes (gunicorn workers, bulk jobs) may append at once; writes
+    are serialized with a file lock and a row only counts once all four
+    files hold it, so readers never see a half-written entry. Each ``id``
+    is stored once; the set of ids is kept in memory and caught up with rows
+    other processes appended whenever it is consulted.
+    """
+
+    def __init__(self, path, dim, version=None):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        self._maps = None
+        self._ids = set()
+        self._id_rows = 0
+        with self._locked():
+            header = self._read_header()
+            if header is None:
+                header = {'dim': dim, 'dtype': 'float16', 'version': version, 'species': [], 'created': time.time()}
+                self._write_header(header)
+            elif header['dim'] != dim:
+                raise ValueError(f"{path} holds {header['dim']}-d vectors, not {dim}-d")
+        self.header = header
+        self.version = header['version']
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self):
+        with open(self._file('.lock'), 'a+') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+                return
+            lock.seek(0)
+            while True:
+                # LK_LOCK gives up after about 10 seconds of retries
+                try:
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _read_header(self):
+        try:
+            with open(self._file('index.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_header(self, header):
+        tmp_path = self._file('index.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(header, f)
+        os.replace(tmp_path, self._file('index.json'))
+
+    def _rows(self, name, row_bytes):
+        try:
+            return os.path.getsize(self._file(name)) // row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def __len__(self):
+        """Rows present in every file, i.e. fully written"""
+        return min(
+            self._rows('vectors.f16', self.dim * np.dtype(VECTOR_DTYPE).itemsize),
+            self._rows('species.u8', 1),
+            self._rows('offsets.u64', 8)
+        )
+
+    def _truncate_to(self, count):
+        # Drop the tail of an append that crashed part-way through
+        for name, row_bytes in (('vectors.f16', self.dim * np.dtype(VECTOR_DTYPE).itemsize),
+                                ('species.u8', 1), ('offsets.u64', 8)):
+            if os.path.exists(self._file(name)):
+                os.truncate(self._file(name), count * row_bytes)
+        if count and os.path.exists(self._file('meta.jsonl')):
+            with open(self._file('offsets.u64'), 'rb') as f:
+                f.seek((count - 1) * 8)
+                last = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            with open(self._file('meta.jsonl'), 'rb') as f:
+                f.seek(last)
+                f.readline()
+                end = f.tell()
+            os.truncate(self._file('meta.jsonl'), end)
+        elif os.path.exists(self._file('meta.jsonl')):
+            os.truncate(self._file('meta.jsonl'), 0)
+
+    def _sync_ids(self):
+        """Read the ids of committed rows added since the last call"""
+        count = len(self)
+        if count <= self._id_rows:
+            return
+        offsets = np.memmap(self._file('offsets.u64'), dtype=np.uint64, mode='r', shape=(count,))
+        with open(self._file('meta.jsonl'), 'rb') as f:
+            f.seek(int(offsets[self._id_rows]))
+            for _ in range(count - self._id_rows):
+                self._ids.add(json.loads(f.readline()).get('id'))
+        self._id_rows = count
+
+    def __contains__(self, item_id):
+        self._sync_ids()
+        return item_id in self._ids
+
+    def species_code(self, species):
+        return self.header['species'].index(species) if species in self.header['species'] else None
+
+    def add(self, vectors, metadata):
+        """Append embeddings with one metadata dict each (``species`` is used for filtering).
+
+        Entries whose ``id`` is already in the index are skipped; returns the
+        number of rows added.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) != len(metadata):
+            raise ValueError("vectors and metadata must have the same length")
+        if not len(vectors):
+            return 0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.maximum(norms, 1e-12)).astype(VECTOR_DTYPE)
+
+        with self._locked():
+            self._sync_ids()
+            keep, seen = [], set()
+            for i, meta in enumerate(metadata):
+                item_id = meta.get('id')
+                if item_id is not None and (item_id in self._ids or item_id in seen):
+                    continue
+                seen.add(item_id)
+                keep.append(i)
+            if not keep:
+                return 0
+            vectors = vectors[keep]
+            metadata = [metadata[i] for i in keep]
+
+            header = self._read_header()
+            for meta in metadata:
+                if meta.get('species') not in header['species']:
+                    header['species'].append(meta.get('species'))
+                    self._write_header(header)
+            self.header = header
+            codes = np.array([header['species'].index(meta.get('species')) for meta in metadata], dtype=np.uint8)
+
+            self._truncate_to(len(self))
+            offsets = []
+            with open(self._file('meta.jsonl'), 'ab') as f:
+                for meta in metadata:
+                    offsets.append(f.tell())
+                    f.write((json.dumps(meta) + '\n').encode())
+            # Vectors go last: a row is only visible once they are written
+            for name, data in (('offsets.u64', np.array(offsets, dtype=np.uint64)),
+                               ('species.u8', codes),
+                               ('vectors.f16', vectors)):
+                with open(self._file(name), 'ab') as f:
+                    f.write(data.tobytes())
+            return len(metadata)
+
+    def _mapped(self):
+        """Memory maps of the committed rows, reopened only when the index has grown"""
+        count = len(self)
+        if self._maps is None or self._maps[0] != count:
+            if count == 0:
+                return 0, None, None
+            # Copy-on-write so torch can wrap it without a copy; nothing ever writes to it
+            vectors = np.memmap(self._file('vectors.f16'), dtype=VECTOR_DTYPE, mode='c', shape=(count, self.dim))
+            codes = np.memmap(self._file('species.u8'), dtype=np.uint8, mode='r', shape=(count,))
+            self._maps = (count, vectors, codes)
+        return self._maps
+
+    def _metadata(self, rows):
+        offsets = np.memmap(self._file('offsets.u64'), dtype=np.uint64, mode='r')
+        results = []
+        with open(self._file('meta.jsonl'), 'rb') as f:
+            for row in rows:
+                f.seek(int(offsets[row]))
+                results.append(json.loads(f.readline()))
+        return results
+
+    def search(self, query, k=5, species=None, chunk_rows=65536):
+        """Top-``k`` rows by cosine similarity to ``query``, best first, as (score, metadata).
+
+        The scan multiplies ``chunk_rows`` float16 rows at a time straight
+        from the memory map (no float32 copy) and keeps a running top-k, so
+        memory use is bounded by the chunk size rather than by the index size.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        query = torch.from_numpy(query / max(float(np.linalg.norm(query)), 1e-12)).to(torch.float16)
+        count, vectors, codes = self._mapped()
+        if count == 0 or k <= 0:
+            return []
+        code = None
+        if species is not None:
+            self.header = self._read_header()
+            code = self.species_code(species)
+            if code is None:
+                return []
+
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for start in range(0, count, chunk_rows):
+            end = min(start + chunk_rows, count)
+            scores = (torch.from_numpy(vectors[start:end]) @ query).float().numpy()
+            if code is not None:
+                scores[codes[start:end] != code] = -np.inf
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+            else:
+                top = np.arange(len(scores))
+            best_scores = np.concatenate([best_scores, scores[top]])
+            best_rows = np.concatenate([best_rows, top + start])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k)[:k]
+                best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+        order = np.argsort(-best_scores)
+        best_scores, best_rows = best_scores[order], best_rows[order]
+        found = np.isfinite(best_scores)
+        best_scores, best_rows = best_scores[found], best_rows[found]
+        return list(zip(best_scores.tolist(), self._metadata(best_rows.tolist())))
+
+    def stats(self):
+        return {
+            'entries': len(self),
+            'dim': self.dim,
+            'dtype': 'float16',
+            'version': self.version,
+            'species': self.header['species'],
+            'bytes': sum(os.path.getsize(self._file(name)) for name in ('vectors.f16', 'species.u8', 'offsets.u64')
+                         if os.path.exists(self._file(name)))
+        }
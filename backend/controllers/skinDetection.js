@@ -81,6 +81,7 @@ exports.analyzeSkin = async (req, res) => {
       confidence: aiResponse.data.confidence,
       species: pet.species,
       notes,
+      embedding_id: aiResponse.data.embedding_id,
       recommendation: enhancedRecommendation
     });
 
@@ -9,6 +9,8 @@ const skinConditionDetectionSchema = new mongoose.Schema({
   confidence: { type: Number, required: true },
   species: { type: String, required: true },
   notes: String,
+  // Key of this image in the AI service's similarity index (/similar results carry it as `id`)
+  embedding_id: String,
 recommendation: {
   type: Object,
   required: true